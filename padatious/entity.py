@@ -38,11 +38,34 @@ class Entity(SimpleIntent, Trainable):
         else:
             return '{' + name + '}'
 
+    def split_training(self, train_data):
+        return [self]
+
+    def join_training(self, parts):
+        self.ids, self.net = parts[0].ids, parts[0].net
+
+    def trained_parts(self):
+        return [self]
+
+    def negatives_hashes(self, train_data):
+        return [self.negatives_hash(train_data)]
+
     def save(self, folder):
         prefix = join(folder, self.name)
         SimpleIntent.save(self, prefix)
         self.save_hash(prefix)
 
+    def pack(self, writer):
+        record = SimpleIntent.pack(self, writer)
+        record['hash'] = self.hash.hex()
+        return record
+
+    @classmethod
+    def from_pack(cls, name, record, pack):
+        self = super(Entity, cls).from_pack(name, record, pack)
+        self.hash = bytes.fromhex(record['hash'])
+        return self
+
     @classmethod
     def from_file(cls, name, folder):
         self = super(Entity, cls).from_file(name, join(folder, name))
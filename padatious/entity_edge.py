@@ -12,10 +12,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import numpy as np
 from fann2 import libfann as fann
 
 from padatious.id_manager import IdManager
-from padatious.util import StrEnum, resolve_conflicts
+from padatious.numpy_net import NumpyNet
+from padatious.util import StrEnum, lines_hash, resolve_conflicts
 
 
 class Ids(StrEnum):
@@ -36,49 +38,96 @@ class EntityEdge(object):
         self.intent_name = intent_name
         self.token = token
         self.dir = direction
-        self.net = None
+        self.net = None  # type: NumpyNet
 
     def get_end(self, sent):
         return len(sent) if self.dir > 0 else -1
 
     def vectorize(self, sent, pos):
+        return self.assign_features(self.ids.vector(), sent, pos)
+
+    def sparse_vectorize(self, sent, pos):
+        """Same as vectorize but only builds the non-zero {index: value} entries"""
+        return self.assign_features(self.ids.sparse_vector(), sent, pos)
+
+    def assign_features(self, vector, sent, pos):
         unknown = 0
-        vector = self.ids.vector()
         end_pos = self.get_end(sent)
-        for i in range(pos + self.dir, end_pos, self.dir):
-            if sent[i] in self.ids:
-                self.ids.assign(vector, sent[i], 1.0 / abs(i - pos))
+        positions = range(pos + self.dir, end_pos, self.dir)
+        *indices, end = self.ids.lookup([sent[i] for i in positions] + [Ids.end])
+        for i, index in zip(positions, indices):
+            if index is not None:
+                vector[index] = 1.0 / abs(i - pos)
             else:
                 unknown += 1
-        self.ids.assign(vector, Ids.end, 1.0 / abs(end_pos - pos))
+        vector[end] = 1.0 / abs(end_pos - pos)
         return vector
 
     def match(self, sent, pos):
-        return self.net.run(self.vectorize(sent, pos))[0]
+        return self.net.run_sparse_batch([self.sparse_vectorize(sent, pos)])[0, 0]
+
+    def match_all(self, sent):
+        """
+        Calculates match() for every position of the sentence at once.
+        Tokens are looked up once and the features of all positions are
+        built as one position x token distance matrix
+
+        Args:
+            sent (list<str>): Tokenized sentence
+        Returns:
+            np.ndarray: Confidence of each position
+        """
+        if len(sent) == 0:
+            return np.zeros(0, dtype=np.float32)
+        local = np.array([-1 if i is None else i for i in self.ids.lookup(sent)])
+
+        # vectorize() overwrites repeated tokens so only the one furthest
+        # in the direction of the edge is used
+        order = slice(None, None, -self.dir)
+        _, first = np.unique(local[order], return_index=True)
+        cols = np.sort(np.arange(len(sent))[order][first])
+        cols = cols[local[cols] >= 0]
+
+        positions = np.arange(len(sent))
+        dist = (cols[None, :] - positions[:, None]) * self.dir
+        features = np.where(dist > 0, 1.0 / np.maximum(dist, 1), 0.0).astype(np.float32)
+        end_dist = np.abs(self.get_end(sent) - positions).astype(np.float32)
+
+        weights = self.net.weights[0]
+        sums = features.dot(weights[local[cols]])
+        sums += (1.0 / end_dist)[:, None] * weights[self.ids.ids[Ids.end]]
+        hidden = self.net.activate(0, sums + self.net.biases[0])
+        return self.net.forward(hidden, 1)[:, 0]
 
     def configure_net(self):
         layers = [len(self.ids), 3, 1]
 
-        self.net = fann.neural_net()
-        self.net.create_standard_array(layers)
-        self.net.set_activation_function_hidden(fann.SIGMOID_SYMMETRIC_STEPWISE)
-        self.net.set_activation_function_output(fann.SIGMOID_STEPWISE)
-        self.net.set_train_stop_function(fann.STOPFUNC_BIT)
-        self.net.set_bit_fail_limit(0.1)
+        net = fann.neural_net()
+        net.create_standard_array(layers)
+        net.set_activation_function_hidden(fann.SIGMOID_SYMMETRIC_STEPWISE)
+        net.set_activation_function_output(fann.SIGMOID_STEPWISE)
+        net.set_train_stop_function(fann.STOPFUNC_BIT)
+        net.set_bit_fail_limit(0.1)
+        return net
 
     def save(self, prefix):
         prefix += '.' + {-1: 'l', +1: 'r'}[self.dir]
-        self.net.save(str(prefix + '.net'))  # Must have str()
+        self.net.save(prefix + '.net')
         self.ids.save(prefix)
 
     def load(self, prefix):
         prefix += '.' + {-1: 'l', +1: 'r'}[self.dir]
-        self.net = fann.neural_net()
-        if not self.net.create_from_file(str(prefix + '.net')):  # Must have str()
-            raise FileNotFoundError(str(prefix + '.net'))
+        self.net = NumpyNet.from_file(prefix + '.net')
         self.ids.load(prefix)
 
-    def train(self, train_data):
+    def pack(self, writer):
+        return {'net': writer.add_net(self.net), 'ids': writer.add_vocab(self.ids.ids)}
+
+    def unpack(self, record, pack):
+        self.net = pack.net(record['net'])
+        self.ids.ids = pack.vocab(record['ids'])
+
+    def build_ids(self, train_data):
         for sent in train_data.my_sents(self.intent_name):
             if self.token in sent:
                 for i in range(sent.index(self.token) + self.dir,
@@ -86,6 +135,23 @@ class EntityEdge(object):
                     if sent[i][0] != '{':
                         self.ids.add_token(sent[i])
 
+    def negatives_hash(self, train_data):
+        """Hash of the negative samples as seen by the network (see SimpleIntent)"""
+        probe = EntityEdge(self.dir, self.token, self.intent_name)
+        probe.build_ids(train_data)
+        return lines_hash(sorted({
+            '\t'.join(probe.ids.adj_token(token) if token in probe.ids else '' for token in sent)
+            for sent in train_data.negative_sents(self.intent_name)
+        })).hex()
+
+    def train_size(self, train_data):
+        """Estimated number of training samples, used to schedule training"""
+        return sum(len(sent) for sent in train_data.my_sents(self.intent_name)) + \
+            int(train_data.num_negatives(self.intent_name) * train_data.average_len())
+
+    def train(self, train_data):
+        self.build_ids(train_data)
+
         inputs, outputs = [], []
 
         def pollute(sent, i, out_val):
@@ -109,15 +175,16 @@ class EntityEdge(object):
                         pollute(sent, i, 1.0)
 
         add_sents(train_data.my_sents(self.intent_name), lambda x: float(x == self.token))
-        add_sents(train_data.other_sents(self.intent_name), lambda x: 0.0)
+        add_sents(train_data.negative_sents(self.intent_name), lambda x: 0.0)
         inputs, outputs = resolve_conflicts(inputs, outputs)
 
         data = fann.training_data()
         data.set_train_data(inputs, outputs)
 
         for _ in range(10):
-            self.configure_net()
-            self.net.train_on_data(data, 1000, 0, 0)
-            self.net.test_data(data)
-            if self.net.get_bit_fail() == 0:
+            net = self.configure_net()
+            net.train_on_data(data, 1000, 0, 0)
+            net.test_data(data)
+            if net.get_bit_fail() == 0:
                 break
+        self.net = NumpyNet.from_fann(net)
@@ -12,27 +12,117 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from threading import Lock
+
 from padatious.entity import Entity
 from padatious.training_manager import TrainingManager
+from padatious.util import CacheInfo, LRUCache
+
+
+class EntityMemo(object):
+    """
+    Remembers Entity.match results while matching one query so
+    a span is only scored once across candidate chains and intents.
+    Each memo is used by one thread; the counters it updates are shared
+
+    Args:
+        manager (EntityManager): Manager holding the shared cache and counters
+    """
+    def __init__(self, manager):
+        self.manager = manager
+        self.results = {}
+
+    def match(self, entity, span):
+        key = (entity.name, entity.hash, tuple(span))
+        conf = self.results.get(key)
+        if conf is None and self.manager.match_cache is not None:
+            conf = self.manager.match_cache.get(key)
+            if conf is not None:
+                self.results[key] = conf
+        if conf is not None:
+            self.manager.count(hit=True)
+            return conf
+
+        self.manager.count(hit=False)
+        conf = self.results[key] = entity.match(span)
+        if self.manager.match_cache is not None:
+            self.manager.match_cache.put(key, conf)
+        return conf
+
+
+class EntitySet(object):
+    """
+    Fixed set of entities that intents can be matched with while the
+    entities of the manager it was taken from are retrained
+
+    Args:
+        manager (EntityManager): Manager holding the shared match cache
+        entity_dict (dict<str, Entity>): Entity of each wrapped name
+    """
+    def __init__(self, manager, entity_dict):
+        self.manager = manager
+        self.entity_dict = entity_dict
+
+    def find(self, intent_name, token):
+        local_name, global_name = '', token
+        if ':' in intent_name:
+            local_name = intent_name.split(':')[0] + ':' + token
+        return self.entity_dict.get(local_name, self.entity_dict.get(global_name))
+
+    def memo(self):
+        return self.manager.memo()
 
 
 class EntityManager(TrainingManager):
-    def __init__(self, cache):
-        super(EntityManager, self).__init__(Entity, cache)
+    """
+    Args:
+        cache (str): Place to store cache files
+        match_cache_size (int): Entity matches to remember across queries
+        **kwargs: Loading options of TrainingManager
+    """
+    def __init__(self, cache, match_cache_size=0, **kwargs):
+        super(EntityManager, self).__init__(Entity, cache, **kwargs)
         self.entity_dict = {}
+        self.match_cache = LRUCache(match_cache_size) if match_cache_size else None
+        self.memo_hits = self.memo_misses = 0
+        self.memo_lock = Lock()
 
     def calc_ent_dict(self):
         for i in self.objects:
             self.entity_dict[i.name] = i
+        if self.match_cache is not None:
+            self.match_cache.clear()
 
     def find(self, intent_name, token):
-        local_name, global_name = '', token
-        if ':' in intent_name:
-            local_name = intent_name.split(':')[0] + ':' + token
-        return self.entity_dict.get(local_name, self.entity_dict.get(global_name))
+        return EntitySet(self, self.entity_dict).find(intent_name, token)
+
+    def snapshot(self):
+        """Copy of the current entities that later training does not change"""
+        return EntitySet(self, dict(self.entity_dict))
+
+    def memo(self):
+        """Creates a cache of entity matches for a single query"""
+        return EntityMemo(self)
+
+    def count(self, hit):
+        """Records a memoized entity match. Memos of several threads share the counters"""
+        with self.memo_lock:
+            if hit:
+                self.memo_hits += 1
+            else:
+                self.memo_misses += 1
+
+    def cache_info(self):
+        """Hits and misses of all memoized entity matches"""
+        shared = self.match_cache.info() if self.match_cache is not None else CacheInfo(0, 0, 0, 0, 0)
+        with self.memo_lock:
+            hits, misses = self.memo_hits, self.memo_misses
+        return CacheInfo(hits, misses, shared.evictions, shared.maxsize, shared.currsize)
 
     def remove(self, name):
         name = '{' + name + '}'
         if name in self.entity_dict:
             del self.entity_dict[name]
+        if self.match_cache is not None:
+            self.match_cache.clear()
         super(EntityManager, self).remove(name)
@@ -13,14 +13,53 @@
 # limitations under the License.
 
 import json
+import sys
+from threading import Lock
 
 from padatious.util import StrEnum
 
+_DIGITS = str.maketrans('0123456789', '#' * 10)
+
+
+class TokenTable(object):
+    """
+    Tokens and indices shared by every vocabulary of the process so a word
+    used by many networks is stored once instead of once per vocabulary.
+    Tokens are interned with sys.intern so they are freed along with the
+    last vocabulary using them. Indices only go up to the largest vocabulary
+    """
+
+    def __init__(self):
+        self.indices = []
+        self.lock = Lock()
+
+    @staticmethod
+    def token(token):
+        """The shared copy of a token"""
+        return sys.intern(token)
+
+    def index(self, index):
+        """The shared int object of an index"""
+        indices = self.indices
+        if index >= len(indices):
+            with self.lock:
+                indices.extend(range(len(indices), index + 1))
+        return indices[index]
+
+    def vocab(self, ids):
+        """Copy of a token -> index mapping that uses the shared objects"""
+        token, index = self.token, self.index
+        return {token(k): index(v) for k, v in ids.items()}
+
+
+tokens = TokenTable()
+
 
 class IdManager(object):
     """
     Gives manages specific unique identifiers for tokens.
-    Used to convert tokens to vectors
+    Used to convert tokens to vectors. Tokens and indices of the
+    vocabulary are the shared objects of the TokenTable
     """
     def __init__(self, id_cls=StrEnum, ids=None):
         if ids is not None:
@@ -30,39 +69,66 @@ class IdManager(object):
             for i in id_cls.values():
                 self.add_token(i)
 
+    @property
+    def ids(self):
+        return self._ids
+
+    @ids.setter
+    def ids(self, ids):
+        """Dicts are rebuilt from shared tokens, other mappings (ie. PackedVocab) kept as they are"""
+        self._ids = tokens.vocab(ids) if isinstance(ids, dict) else ids
+
     def __len__(self):
         return len(self.ids)
 
     @staticmethod
     def adj_token(token):
         if token.isdigit():
-            for i in range(10):
-                if str(i) in token:
-                    token = token.replace(str(i), '#')
+            token = token.translate(_DIGITS)
         return token
 
     def vector(self):
         return [0.0] * len(self.ids)
 
+    def sparse_vector(self):
+        """Empty {index: value} vector. Works with assign() just like vector()"""
+        return {}
+
     def save(self, prefix):
         with open(prefix + '.ids', 'w') as f:
-            json.dump(self.ids, f)
+            json.dump(dict(self.ids), f)
 
     def load(self, prefix):
         with open(prefix + '.ids', 'r') as f:
             self.ids = json.load(f)
 
+    def lookup(self, sent):
+        """
+        Index of each token of a sentence, normalizing each one only once
+
+        Args:
+            sent (list<str>): Tokens to look up
+        Returns:
+            list<int>: Index of each token or None if it is unknown
+        """
+        get = self._ids.get
+        return [get(token.translate(_DIGITS) if token.isdigit() else token) for token in sent]
+
     def assign(self, vector, key, val):
-        vector[self.ids[self.adj_token(key)]] = val
+        vector[self._ids[self.adj_token(key)]] = val
 
     def __contains__(self, token):
-        return self.adj_token(token) in self.ids
+        return self.adj_token(token) in self._ids
 
     def add_token(self, token):
-        token = self.adj_token(token)
-        if token not in self.ids:
-            self.ids[token] = len(self.ids)
+        self.add_sent([token])
 
     def add_sent(self, sent):
+        if not isinstance(self._ids, dict):
+            self.ids = dict(self._ids)
+        ids = self._ids
         for token in sent:
-            self.add_token(token)
+            if token.isdigit():
+                token = token.translate(_DIGITS)
+            if token not in ids:
+                ids[tokens.token(token)] = tokens.index(len(ids))
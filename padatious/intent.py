@@ -24,6 +24,7 @@ from padatious.trainable import Trainable
 
 class Intent(Trainable):
     """Full intent object to handle entity extraction and intent matching"""
+    BEAM_WIDTH = None  # Partial extractions kept between entities (None for all)
 
     def __init__(self, *args, **kwargs):
         super(Intent, self).__init__(*args, **kwargs)
@@ -31,19 +32,64 @@ class Intent(Trainable):
         self.pos_intents = []
 
     def match(self, sent, entities=None):
-        possible_matches = [MatchData(self.name, sent)]
-        for pi in self.pos_intents:
-            entity = entities.find(self.name, pi.token) if entities else None
-            for i in list(possible_matches):
-                possible_matches += pi.match(i, entity)
+        return self.match_batch([sent], entities)[0]
 
-        possible_matches = [i for i in possible_matches if i.conf >= 0.0]
+    def match_batch(self, sents, entities=None, simple_confs=None, memo=None):
+        """
+        Matches the intent against several tokenized sentences at once,
+        scoring all candidate extractions with a single network pass
 
-        for i in possible_matches:
+        Args:
+            sents (list<list<str>>): Tokenized input sentences
+            entities (EntityManager): Entities used for extraction
+            simple_confs (list<float>): Precomputed SimpleIntent confidence
+                of each unmodified sentence (ie. from an IntentBank)
+            memo (EntityMemo): Cache of entity matches shared across intents
+        Returns:
+            list<MatchData>: Best match for each sentence
+        """
+        all_matches = []
+        for sent in sents:
+            possible_matches = [MatchData(self.name, sent)]
+            for n, pi in enumerate(self.pos_intents):
+                entity = entities.find(self.name, pi.token) if entities else None
+                for i in list(possible_matches):
+                    possible_matches += pi.match(i, entity, memo)
+                if n + 1 < len(self.pos_intents):
+                    possible_matches = self.prune(possible_matches)
+
+            all_matches.append([i for i in possible_matches if i.conf >= 0.0])
+
+        if simple_confs is None:
+            candidates = [i for possible_matches in all_matches for i in possible_matches]
+            simple_confs = self.simple_intent.match_batch([i.sent for i in candidates])
+        else:
+            # The first match of each sentence is the unmodified sentence
+            extracted = [i for possible_matches in all_matches for i in possible_matches[1:]]
+            extracted_confs = iter(self.simple_intent.match_batch([i.sent for i in extracted]))
+            candidates, confs = [], []
+            for possible_matches, simple_conf in zip(all_matches, simple_confs):
+                candidates += possible_matches
+                confs += [simple_conf] + [next(extracted_confs) for _ in possible_matches[1:]]
+            simple_confs = confs
+
+        for i, simple_conf in zip(candidates, simple_confs):
             conf = ((i.conf / len(i.matches)) if len(i.matches) > 0 else 0) + 0.5
-            i.conf = math.sqrt(conf * self.simple_intent.match(i.sent))
+            i.conf = math.sqrt(conf * simple_conf)
+
+        return [max(possible_matches, key=lambda x: x.conf) for possible_matches in all_matches]
 
-        return max(possible_matches, key=lambda x: x.conf)
+    def prune(self, possible_matches):
+        """
+        Keeps the unmodified sentence and the BEAM_WIDTH best extractions
+        before the next entity is extracted. Extractions are ranked on their
+        entity confidence alone, so a limit can drop the best final match
+        """
+        extracted = possible_matches[1:]
+        if self.BEAM_WIDTH is None or len(extracted) <= self.BEAM_WIDTH:
+            return possible_matches
+        best = set(sorted(range(len(extracted)), key=lambda x: -extracted[x].conf)[:self.BEAM_WIDTH])
+        return possible_matches[:1] + [i for n, i in enumerate(extracted) if n in best]
 
     def save(self, folder):
         prefix = join(folder, self.name)
@@ -69,9 +115,47 @@ class Intent(Trainable):
             self.pos_intents.append(PosIntent.from_file(prefix, token))
         return self
 
+    def pack(self, writer):
+        return {
+            'hash': self.hash.hex(),
+            'simple': self.simple_intent.pack(writer),
+            'pos': [i.pack(writer) for i in self.pos_intents]
+        }
+
+    @classmethod
+    def from_pack(cls, name, record, pack):
+        self = cls(name, bytes.fromhex(record['hash']))
+        self.simple_intent = SimpleIntent.from_pack(name, record['simple'], pack)
+        self.pos_intents = [PosIntent.from_pack(i, pack) for i in record['pos']]
+        return self
+
+    def entity_tokens(self, train_data):
+        return set([token for sent in train_data.my_sents(self.name)
+                    for token in sent if token.startswith('{')])
+
+    def negatives_hashes(self, train_data):
+        return [self.simple_intent.negatives_hash(train_data)] + [
+            edge.negatives_hash(train_data)
+            for i in sorted(self.entity_tokens(train_data))
+            for edge in PosIntent(i, self.name).edges
+        ]
+
+    def split_training(self, train_data):
+        tokens = sorted(self.entity_tokens(train_data))
+        self.pos_intents = [PosIntent(i, self.name) for i in tokens]
+        return [self.simple_intent] + [edge for i in self.pos_intents for edge in i.edges]
+
+    def join_training(self, parts):
+        self.simple_intent = parts[0]
+        for n, pos_intent in enumerate(self.pos_intents):
+            pos_intent.edges = list(parts[1 + 2 * n:3 + 2 * n])
+
+    def trained_parts(self):
+        pos_intents = sorted(self.pos_intents, key=lambda x: x.token)
+        return [self.simple_intent] + [edge for i in pos_intents for edge in i.edges]
+
     def train(self, train_data):
-        tokens = set([token for sent in train_data.my_sents(self.name)
-                      for token in sent if token.startswith('{')])
+        tokens = self.entity_tokens(train_data)
         self.pos_intents = [PosIntent(i, self.name) for i in tokens]
 
         self.simple_intent.train(train_data)
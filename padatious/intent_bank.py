@@ -0,0 +1,303 @@
+# Copyright 2017 Mycroft AI, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+from collections import OrderedDict
+
+import numpy as np
+
+from padatious.id_manager import IdManager
+from padatious.numpy_net import activate
+from padatious.simple_intent import Ids
+
+
+class _Block(object):
+    """
+    Weights of one SimpleIntent with its vocabulary mapped to global token ids.
+    First layer rows are read from the network when the bank is compiled
+    rather than copied, so a memory mapped network is not held twice
+    """
+
+    def __init__(self, simple_intent, token_ids):
+        net = simple_intent.net
+        ids = simple_intent.ids.ids
+        specials = [ids[i] for i in (Ids.unknown_tokens, Ids.w_1, Ids.w_2, Ids.w_3, Ids.w_4)]
+        tokens = [(token, i) for token, i in ids.items() if i not in specials]
+        for token, _ in tokens:
+            if token not in token_ids:
+                token_ids[token] = len(token_ids)
+
+        self.simple_intent = simple_intent
+        self.tokens = np.array([token_ids[token] for token, _ in tokens], dtype=np.int64)
+        self.row_ids = np.array([i for _, i in tokens], dtype=np.int64)
+        entity_rows = net.weights[0][[i for token, i in tokens if token.startswith('{')]]
+        self.entity_low = np.minimum(entity_rows, 0).sum(axis=0)
+        self.entity_high = np.maximum(entity_rows, 0).sum(axis=0)
+        self.special_rows = net.weights[0][specials]
+        self.bias = net.biases[0]
+        self.steepness = net.steepnesses[0]
+        self.hidden_func = net.activations[0]
+        self.out_weights = net.weights[1][:, 0]
+        self.out_bias = net.biases[1][0]
+        self.out_steepness = net.steepnesses[1][0]
+        self.out_func = net.activations[1]
+
+    def rows(self):
+        return self.simple_intent.net.weights[0][self.row_ids]
+
+    @staticmethod
+    def supports(simple_intent):
+        net = simple_intent.net
+        return net is not None and len(net.weights) == 2 and net.weights[1].shape[1] == 1
+
+
+class IntentBank(object):
+    """
+    All SimpleIntent networks of an IntentManager stacked into one model
+
+    Every vocabulary is merged into a single global token index and the
+    first layer weights are stored as a sparse (CSR) token x hidden matrix
+    so one query scores the raw sentence against every intent at once.
+    Blocks are added and removed per intent, and the stacked matrices are
+    rebuilt from the cached blocks the next time they are needed.
+    """
+    BOUND_MARGIN = 1e-4  # Added to upper bounds to cover float32 rounding
+
+    def __init__(self):
+        self.token_ids = {}
+        self.blocks = OrderedDict()
+        self.compile()
+
+    def __len__(self):
+        return len(self.blocks)
+
+    @property
+    def names(self):
+        """Intent name of each column returned by score_batch"""
+        return list(self.blocks)
+
+    def add(self, name, simple_intent):
+        if not _Block.supports(simple_intent):
+            return
+        self.blocks[name] = _Block(simple_intent, self.token_ids)
+        self.must_compile = True
+
+    def remove(self, name):
+        if self.blocks.pop(name, None) is not None:
+            self.must_compile = True
+
+    def copy(self):
+        """Bank sharing the blocks of this one that can be updated separately"""
+        bank = copy.copy(self)
+        bank.token_ids = dict(self.token_ids)
+        bank.blocks = OrderedDict(self.blocks)
+        return bank
+
+    def update(self, intents):
+        """
+        Adds and removes blocks so the bank matches the list of Intents.
+        Lazy intents that are not loaded yet are left out rather than loaded
+        """
+        current = {i.name: i.simple_intent for i in intents if getattr(i, 'loaded', True)}
+        for name, block in list(self.blocks.items()):
+            if current.get(name) is not block.simple_intent:
+                self.remove(name)
+        for name, simple_intent in current.items():
+            if name not in self.blocks:
+                self.add(name, simple_intent)
+
+    def compile(self):
+        blocks = list(self.blocks.values())
+        hidden_sizes = np.array([len(b.bias) for b in blocks], dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(hidden_sizes)])[:-1]
+        self.num_hidden = int(hidden_sizes.sum())
+        self.hidden_owner = np.repeat(np.arange(len(blocks)), hidden_sizes)
+
+        def cat(values, dtype=np.float32):
+            return np.concatenate([np.asarray(v, dtype) for v in values]) if values else \
+                np.zeros(0, dtype)
+
+        self.bias = cat([b.bias for b in blocks])
+        self.steepness = cat([b.steepness for b in blocks])
+        self.hidden_funcs = cat([[b.hidden_func] * len(b.bias) for b in blocks], np.int64)
+        self.special_rows = np.concatenate([b.special_rows for b in blocks], axis=1) \
+            if blocks else np.zeros((5, 0), np.float32)
+        self.entity_low = cat([b.entity_low for b in blocks])
+        self.entity_high = cat([b.entity_high for b in blocks])
+        self.out_weights = cat([b.out_weights for b in blocks])
+        self.out_bias = cat([[b.out_bias] for b in blocks])
+        self.out_steepness = cat([[b.out_steepness] for b in blocks])
+        self.out_funcs = cat([[b.out_func] for b in blocks], np.int64)
+
+        # CSR matrix of global token -> (hidden column, weight)
+        tokens = cat([np.repeat(b.tokens, len(b.bias)) for b in blocks], np.int64)
+        columns = cat([np.tile(np.arange(len(b.bias)), len(b.tokens)) + offset
+                       for b, offset in zip(blocks, self.offsets)], np.int64)
+        data = cat([b.rows().ravel() for b in blocks])
+        order = np.argsort(tokens, kind='stable')
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(tokens,
+                                                                 minlength=len(self.token_ids)))])
+        self.indices = columns[order]
+        self.data = data[order]
+
+        # CSR matrix of global token -> intents containing it
+        owners = cat([np.full(len(b.tokens), i) for i, b in enumerate(blocks)], np.int64)
+        tokens = cat([b.tokens for b in blocks], np.int64)
+        order = np.argsort(tokens, kind='stable')
+        self.intent_indptr = np.concatenate([[0], np.cumsum(np.bincount(tokens, minlength=len(self.token_ids)))])
+        self.intent_indices = owners[order]
+        self.must_compile = False
+
+    def _token_ids(self, sent):
+        ids = (self.token_ids.get(IdManager.adj_token(token)) for token in sent)
+        return np.array([i for i in ids if i is not None], dtype=np.int64)
+
+    @staticmethod
+    def _gather(indptr, indices, rows):
+        """Concatenated CSR entries of the given rows and the row each came from"""
+        starts, ends = indptr[rows], indptr[rows + 1]
+        lengths = ends - starts
+        positions = np.repeat(ends - np.cumsum(lengths), lengths) + np.arange(lengths.sum())
+        return indices[positions], positions, np.repeat(np.arange(len(rows)), lengths)
+
+    @staticmethod
+    def _stack(arrays):
+        sent_ids = np.repeat(np.arange(len(arrays)), [len(i) for i in arrays])
+        return np.concatenate(arrays), sent_ids
+
+    def known_counts(self, sents, occurrences=None):
+        """
+        Counts the tokens of each sentence in the vocabulary of each intent
+        using the inverted token -> intents index
+
+        Args:
+            sents (list<list<str>>): Tokenized sentences
+            occurrences (list<np.ndarray>): Token ids of each sentence if already looked up
+        Returns:
+            np.ndarray: Counts of shape (len(sents), len(self.names))
+        """
+        if self.must_compile:
+            self.compile()
+        num_intents = len(self.blocks)
+        if not sents or num_intents == 0:
+            return np.zeros((len(sents), num_intents), dtype=np.int64)
+        if occurrences is None:
+            occurrences = [self._token_ids(sent) for sent in sents]
+        tokens, token_sents = self._stack(occurrences)
+        owners, _, which = self._gather(self.intent_indptr, self.intent_indices, tokens)
+        return np.bincount(token_sents[which] * num_intents + owners,
+                           minlength=len(sents) * num_intents).reshape(len(sents), num_intents)
+
+    def score_batch(self, sents):
+        """
+        Calculates SimpleIntent.match of every intent for each sentence
+
+        Args:
+            sents (list<list<str>>): Tokenized sentences
+        Returns:
+            np.ndarray: Confidences of shape (len(sents), len(self.names))
+        """
+        if self.must_compile:
+            self.compile()
+        num_intents, num_hidden = len(self.blocks), self.num_hidden
+        if not sents or num_intents == 0:
+            return np.zeros((len(sents), num_intents), dtype=np.float32)
+
+        # Token occurrences and distinct tokens of every sentence
+        occurrences = [self._token_ids(sent) for sent in sents]
+        distinct = [np.unique(i) for i in occurrences]
+        lengths = np.array([len(sent) for sent in sents], dtype=np.float32)
+
+        # Known token features (1.0 for every distinct known token)
+        tokens, token_sents = self._stack(distinct)
+        columns, positions, which = self._gather(self.indptr, self.indices, tokens)
+        sums = np.bincount(token_sents[which] * num_hidden + columns, weights=self.data[positions],
+                           minlength=len(sents) * num_hidden).reshape(len(sents), num_hidden)
+        sums = sums.astype(np.float32)
+
+        # Fraction of tokens unknown to each intent
+        known = self.known_counts(sents, occurrences)
+        safe_lengths = np.maximum(lengths, 1)[:, None]
+        unknown = (lengths[:, None] - known) / safe_lengths
+        unknown[lengths == 0] = 0
+
+        specials = np.column_stack([np.zeros_like(lengths)] + [lengths / i for i in range(1, 5)])
+        sums += specials.dot(self.special_rows)
+        sums += unknown[:, self.hidden_owner] * self.special_rows[0]
+        sums += self.bias
+
+        hidden = self._activate(self.hidden_funcs, sums * self.steepness)
+        out = np.add.reduceat(hidden * self.out_weights, self.offsets, axis=1) + self.out_bias
+        return np.maximum(self._activate(self.out_funcs, out * self.out_steepness), 0)
+
+    @staticmethod
+    def _activate(funcs, sums):
+        """Applies the activation function of each column to steepened sums"""
+        np.clip(sums, -150.0, 150.0, out=sums)
+        result = np.empty_like(sums)
+        for func in np.unique(funcs):
+            mask = funcs == func
+            result[:, mask] = activate(func, sums[:, mask])
+        return result
+
+    def upper_bounds(self, sents):
+        """
+        Upper bound of SimpleIntent.match of every intent for any sentence
+        PosIntents can make from each one by replacing spans of it with an
+        entity token. Such a sentence has some of the known tokens of the
+        original plus entity tokens, an unknown fraction in [0, 1] and a
+        length between 1 and the original's, so each hidden sum lies in an
+        interval that is carried through the (monotonic) activations
+
+        Args:
+            sents (list<list<str>>): Tokenized sentences
+        Returns:
+            np.ndarray: Bounds of shape (len(sents), len(self.names))
+        """
+        if self.must_compile:
+            self.compile()
+        num_intents, num_hidden = len(self.blocks), self.num_hidden
+        if not sents or num_intents == 0:
+            return np.zeros((len(sents), num_intents))
+
+        # Each known token adds between min(0, w) and max(0, w)
+        distinct = [np.unique(self._token_ids(sent)) for sent in sents]
+        tokens, token_sents = self._stack(distinct)
+        columns, positions, which = self._gather(self.indptr, self.indices, tokens)
+        rows = token_sents[which] * num_hidden + columns
+        size = len(sents) * num_hidden
+        weights = self.data[positions]
+        low = np.bincount(rows, weights=np.minimum(weights, 0), minlength=size)
+        high = np.bincount(rows, weights=np.maximum(weights, 0), minlength=size)
+        low, high = (i.reshape(len(sents), num_hidden).astype(np.float64) for i in (low, high))
+
+        # Length features are linear in the length
+        per_length = sum(self.special_rows[i].astype(np.float64) / i for i in range(1, 5))
+        lengths = np.maximum([len(sent) for sent in sents], 1)
+        shortest, longest = per_length[None, :], np.outer(lengths, per_length)
+        unknown = self.special_rows[0]
+        low += np.minimum(shortest, longest) + np.minimum(unknown, 0) + self.entity_low + self.bias
+        high += np.maximum(shortest, longest) + np.maximum(unknown, 0) + self.entity_high + self.bias
+
+        # Every activation is non-decreasing so the ends of the intervals
+        # map to the ends of the activated ones (swapped by negative steepness)
+        low, high = low * self.steepness, high * self.steepness
+        low, high = (self._activate(self.hidden_funcs, i)
+                     for i in (np.minimum(low, high), np.maximum(low, high)))
+        low, high = low * self.out_weights, high * self.out_weights
+        out_low = np.add.reduceat(np.minimum(low, high), self.offsets, axis=1) + self.out_bias
+        out_high = np.add.reduceat(np.maximum(low, high), self.offsets, axis=1) + self.out_bias
+        out_low, out_high = out_low * self.out_steepness, out_high * self.out_steepness
+        out = self._activate(self.out_funcs, np.maximum(out_low, out_high))
+        return np.maximum(out, 0) + self.BOUND_MARGIN
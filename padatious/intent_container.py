@@ -11,21 +11,32 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import asyncio
 import inspect
 import json
+import math
 import os
 
-import padaos
 import sys
+from collections import namedtuple
+from concurrent.futures import Future
 from functools import wraps
 from subprocess import call, check_output
-from threading import Thread
+from threading import RLock, Thread
 
 from padatious.match_data import MatchData
 from padatious.entity import Entity
 from padatious.entity_manager import EntityManager
 from padatious.intent_manager import IntentManager
-from padatious.util import tokenize
+from padatious.manifest import Manifest
+from padatious.padaos_cache import PadaosCache
+from padatious.query_batcher import QueryBatcher
+from padatious.sharded_matcher import ShardedMatcher
+from padatious.util import LRUCache, tokenize
+
+
+# Immutable snapshot of everything queries are matched against
+ModelSet = namedtuple('ModelSet', 'intents entities padaos')
 
 
 def _save_args(func):
@@ -41,44 +52,176 @@ def _save_args(func):
     return wrapper
 
 
+def _writer(func):
+    """Runs a method that changes the loaded models while holding the container lock"""
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            result = func(self, *args, **kwargs)
+            self._changed()
+        return result
+
+    return wrapper
+
+
 class IntentContainer(object):
     """
     Creates an IntentContainer object used to load and match intents
 
     Args:
         cache_dir (str): Place to put all saved neural networks
+        entity_cache_size (int): Entity matches to remember across queries
+        result_cache_size (int): Query results to remember (0 to disable)
+        result_cache_ttl (float): Seconds cached query results stay valid
+        use_mmap (bool): Memory map trained models read from the cache so
+            processes serving the same cache_dir share one copy of them
+        lazy_load (bool): Only load cached intents and entities on first use
+        prefetch (bool): Load lazy intents and entities in a background thread
+        max_negatives (int): Most sentences of other intents each network
+            is trained against (None for all)
+        max_workers (int): Processes used to train networks (None for one per core)
+        batch_window (float): Seconds calc_intent_async() waits for other queries
+            to match together in one batch (None to match each query alone)
+        num_shards (int): Processes to split intents across for matching
+            (0 to match in this process). Best used with use_mmap. Cached
+            networks are then only loaded by the shards, so lazy_load is
+            implied and prefetch is ignored
+        exhaustive (bool): Run the networks of every intent on each query.
+            Set to False for calc_intent() to only match intents sharing a
+            word with the query or with entities that could hold its other
+            words. calc_intents() always matches every intent
+
+    Concurrency:
+        Queries are matched against a ModelSet, an immutable snapshot of
+        the trained intents, entities and padaos patterns, so any number
+        of threads can call calc_intent() and friends on one container.
+        Methods that add, remove or train intents and entities hold a
+        lock and only mark the snapshot as outdated. The next query
+        builds a new one, so readers never wait for a writer other than
+        during that rebuild. Queries never train: intents and entities
+        that were added but not trained yet are not matched until
+        train() or train_async() is called
     """
 
-    def __init__(self, cache_dir):
+    def __init__(self, cache_dir, entity_cache_size=0, result_cache_size=0,
+                 result_cache_ttl=None, use_mmap=False, lazy_load=False, prefetch=True,
+                 max_negatives=None, max_workers=None, batch_window=None, num_shards=0,
+                 exhaustive=True):
         os.makedirs(cache_dir, exist_ok=True)
         self.cache_dir = cache_dir
+        self.entity_cache_size = entity_cache_size
+        if num_shards:
+            # Cached intents are only loaded by the shards
+            lazy_load, prefetch = True, False
+        self.manager_args = dict(use_mmap=use_mmap, lazy_load=lazy_load, prefetch=prefetch,
+                                 max_negatives=max_negatives, max_workers=max_workers)
+        self.result_cache = LRUCache(result_cache_size, result_cache_ttl) \
+            if result_cache_size else None
+        self.batcher = QueryBatcher(self.calc_intents_batch, batch_window) \
+            if batch_window is not None else None
+        self.best_batcher = QueryBatcher(self.calc_intent_batch, batch_window) \
+            if batch_window is not None else None
+        self.shards = ShardedMatcher(cache_dir, num_shards, use_mmap) if num_shards else None
+        self.exhaustive = exhaustive
         self.must_train = False
-        self.intents = IntentManager(cache_dir)
-        self.entities = EntityManager(cache_dir)
-        self.padaos = padaos.IntentContainer()
+        self.lock = RLock()
+        self._setup_managers()
+        self.padaos = PadaosCache(os.path.join(self.cache_dir, 'padaos.json'))
         self.train_thread = None  # type: Thread
+        self.train_future = None  # type: Future
+        self.models = None  # type: ModelSet
+        self.hold_models = False  # Keep serving self.models until train_async() is done
         self.serialized_args = []  # Arguments of all calls to register intents/entities
 
+    def close(self):
+        """Stops the shard processes. They are started again if the container is used"""
+        if self.shards is not None:
+            self.shards.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @_writer
     def clear(self):
         os.makedirs(self.cache_dir, exist_ok=True)
         self.must_train = False
-        self.intents = IntentManager(self.cache_dir)
-        self.entities = EntityManager(self.cache_dir)
-        self.padaos = padaos.IntentContainer()
+        self._setup_managers()
+        self.padaos = PadaosCache(os.path.join(self.cache_dir, 'padaos.json'))
         self.train_thread = None
+        self.train_future = None
+        self.hold_models = False
         self.serialized_args = []
 
+    def _setup_managers(self):
+        self.intents = IntentManager(self.cache_dir, **self.manager_args)
+        self.entities = EntityManager(self.cache_dir, self.entity_cache_size, **self.manager_args)
+        self.intents.on_trained = self.entities.on_trained = self._on_trained
+
+    def _on_trained(self, obj):
+        """Called as each intent or entity is trained, even after train() timed out"""
+        with self.lock:
+            self.entities.calc_ent_dict()
+            self._changed()
+
+    def _changed(self):
+        """Marks the snapshot queries are matched against as outdated"""
+        with self.lock:
+            if not self.hold_models:
+                self.models = None
+                self.clear_result_cache()
+
+    def snapshot(self):
+        """
+        Returns:
+            ModelSet: Intents, entities and padaos patterns queries are
+                currently matched against. It is never changed once built
+        """
+        models = self.models
+        if models is None:
+            with self.lock:
+                if self.models is None:
+                    # Shards build their own banks from the intents they match
+                    intents = self.intents.snapshot(with_bank=self.shards is None)
+                    self.models = ModelSet(intents, self.entities.snapshot(),
+                                           self.padaos.snapshot())
+                models = self.models
+        return models
+
+    def clear_result_cache(self):
+        """Forgets all cached query results"""
+        if self.result_cache is not None:
+            self.result_cache.clear()
+
+    @_writer
     def instantiate_from_disk(self):
         """
         Instantiates the necessary (internal) data structures when loading persisted model from disk.
         This is done via injecting entities and intents back from cached file versions.
+        The cache manifest is used when present so training lines are only read if needed
         """
+        manifest = Manifest(self.cache_dir)
+        data = manifest.load()
+        if data is None:
+            self._instantiate_from_files()
+            return
+
+        for name, record in data['entities'].items():
+            self.add_entity(name=name, lines=manifest.lazy_lines(record),
+                            reload_cache=False, must_train=False)
+        for name, record in data['intents'].items():
+            self.add_intent(name=name, lines=manifest.lazy_lines(record),
+                            reload_cache=False, must_train=False)
 
+    def _instantiate_from_files(self):
+        """Finds intents and entities by scanning the files of the cache directory"""
         entity_traindata = {}
         intent_traindata = {}
 
-        # workaround: load training data for both entities and intents since
-        # padaos regex needs it for (re)compilation until TODO is cleared
+        # load training data for both entities and intents since their line
+        # hashes decide which cached models and padaos patterns are valid
         for f in os.listdir(self.cache_dir):
             if f.endswith('.entity'):
                 entity_name = f[0:f.find('.entity')]
@@ -92,26 +235,47 @@ class IntentContainer(object):
                     intent_traindata[intent_name] = [line.strip()
                                                      for line in d]
 
-        # TODO: padaos.compile (regex compilation) is redone when loading: find
-        # a way to persist regex, as well!
+        # Unchanged padaos patterns are read back from the cache on compile
+        # Models without a training file in the cache directory are skipped
+        added_intents, added_entities = [], []
         for f in os.listdir(self.cache_dir):
 
             if f.startswith('{') and f.endswith('}.hash'):
                 entity_name = f[1:f.find('}.hash')]
+                if entity_name not in entity_traindata:
+                    continue
                 self.add_entity(
                     name=entity_name,
                     lines=entity_traindata[entity_name],
                     reload_cache=False,
                     must_train=False)
+                added_entities.append(entity_name)
             elif not f.startswith('{') and f.endswith('.hash'):
                 intent_name = f[0:f.find('.hash')]
+                if intent_name not in intent_traindata:
+                    continue
                 self.add_intent(
                     name=intent_name,
                     lines=intent_traindata[intent_name],
                     reload_cache=False,
                     must_train=False)
+                added_intents.append(intent_name)
+
+        # Only the models found on disk are recorded
+        manifest = Manifest(self.cache_dir)
+        intents = {i.name: i for i in self.intents.objects}
+        entities = {i.name: i for i in self.entities.objects}
+        manifest.save({
+            name: manifest.record(name + '.intent', intents[name], intent_traindata[name])
+            for name in added_intents
+        }, {
+            name: manifest.record(name + '.entity', entities[Entity.wrap_name(name)],
+                                  entity_traindata[name])
+            for name in added_entities
+        })
 
     @_save_args
+    @_writer
     def add_intent(self, name, lines, reload_cache=False, must_train=True):
         """
         Creates a new intent, optionally checking the cache first
@@ -126,6 +290,7 @@ class IntentContainer(object):
         self.must_train = must_train
 
     @_save_args
+    @_writer
     def add_entity(self, name, lines, reload_cache=False, must_train=True):
         """
         Adds an entity that matches the given lines.
@@ -149,6 +314,7 @@ class IntentContainer(object):
         self.must_train = must_train
 
     @_save_args
+    @_writer
     def load_entity(
             self,
             name,
@@ -175,6 +341,7 @@ class IntentContainer(object):
         self.load_intent(*args, **kwargs)
 
     @_save_args
+    @_writer
     def load_intent(
             self,
             name,
@@ -195,6 +362,7 @@ class IntentContainer(object):
         self.must_train = must_train
 
     @_save_args
+    @_writer
     def remove_intent(self, name):
         """Unload an intent"""
         self.intents.remove(name)
@@ -202,27 +370,31 @@ class IntentContainer(object):
         self.must_train = True
 
     @_save_args
+    @_writer
     def remove_entity(self, name):
         """Unload an entity"""
         self.entities.remove(name)
         self.padaos.remove_entity(name)
 
     def _train(self, *args, **kwargs):
-        t1 = Thread(
-            target=self.intents.train,
-            args=args,
-            kwargs=kwargs,
-            daemon=True)
-        t2 = Thread(
-            target=self.entities.train,
-            args=args,
-            kwargs=kwargs,
-            daemon=True)
-        t1.start()
-        t2.start()
-        t1.join()
-        t2.join()
-        self.entities.calc_ent_dict()
+        """Trains intents and entities in parallel, raising the first error of either"""
+        errors = []
+
+        def run(manager):
+            try:
+                manager.train(*args, **kwargs)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [Thread(target=run, args=(manager,), daemon=True)
+                   for manager in (self.intents, self.entities)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self._on_trained(None)
+        if errors:
+            raise errors[0]
 
     def train(self, debug=True, force=False, single_thread=False, timeout=20):
         """
@@ -234,23 +406,86 @@ class IntentContainer(object):
             debug (bool): Whether to print a message to stdout each time a new intent is trained
             force (bool): Whether to force training if already finished
             single_thread (bool): Whether to force running in a single thread
-            timeout (float): Seconds before cancelling training
+            timeout (float): Seconds to wait for training. Intents and entities
+                not trained by then keep training in the background and are
+                added as soon as they are done (see training_status())
         Returns:
             bool: True if training succeeded without timeout
         """
-        if not self.must_train and not force:
-            return
-        self.padaos.compile()
-        self.train_thread = Thread(target=self._train, kwargs=dict(
-            debug=debug,
-            single_thread=single_thread,
-            timeout=timeout
-        ), daemon=True)
-        self.train_thread.start()
+        with self.lock:
+            if not self.must_train and not force:
+                return
+            Manifest(self.cache_dir).remove()
+            self.padaos.compile()
+            self.train_thread = Thread(target=self._train, kwargs=dict(
+                debug=debug,
+                single_thread=single_thread,
+                timeout=timeout
+            ), daemon=True)
+            self.train_thread.start()
+            self._changed()
         self.train_thread.join(timeout)
 
         self.must_train = False
-        return not self.train_thread.is_alive()
+        return not (self.train_thread.is_alive() or self.intents.is_training or
+                    self.entities.is_training)
+
+    def train_async(self, debug=False, force=False, single_thread=False):
+        """
+        Trains in the background without interrupting recognition. Queries
+        keep being matched against the intents and entities trained before
+        until all new ones are done, when they are swapped in at once
+
+        Args:
+            See <train>
+        Returns:
+            Future: Resolves to True once the new models are in use
+        """
+        with self.lock:
+            if self.train_future is not None and not self.train_future.done():
+                return self.train_future
+            future = Future()
+            if not self.must_train and not force:
+                future.set_result(True)
+                return future
+
+            # After a failed run the models from before it are still served
+            self.snapshot()
+            self.hold_models = True
+            self.train_future = future
+            self.must_train = False
+            Manifest(self.cache_dir).remove()
+            self.padaos.compile()
+
+        def run():
+            error = None
+            try:
+                self._train(debug=debug, single_thread=single_thread, timeout=None)
+            except Exception as e:
+                error = e
+            finally:
+                with self.lock:
+                    self.hold_models = False
+                    if error is not None:
+                        self.must_train = True  # So the next train() retries
+                    self._changed()
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(True)
+
+        Thread(target=run, daemon=True).start()
+        return future
+
+    def training_status(self):
+        """
+        Reports which intents and entities can be matched
+
+        Returns:
+            dict: {'intents': {name: status}, 'entities': {name: status}}
+                where status is 'trained', 'training' or 'queued'
+        """
+        return {'intents': self.intents.status(), 'entities': self.entities.status()}
 
     def train_subprocess(self, *args, **kwargs):
         """
@@ -263,7 +498,7 @@ class IntentContainer(object):
         """
         ret = call([
             sys.executable, '-m', 'padatious', 'train', self.cache_dir,
-            '-d', json.dumps(self.serialized_args),
+            '-d', json.dumps(self.serialized_args, default=list),
             '-a', json.dumps(args),
             '-k', json.dumps(kwargs),
         ])
@@ -295,29 +530,155 @@ class IntentContainer(object):
             list<MatchData>: List of intent matches
         See calc_intent() for a description of the returned MatchData
         """
-        if self.must_train:
-            self.train()
-        intents = {} if self.train_thread and self.train_thread.is_alive() else {
-            i.name: i for i in self.intents.calc_intents(query, self.entities)
-        }
-        sent = tokenize(query)
-        for perfect_match in self.padaos.calc_intents(query):
-            name = perfect_match['name']
-            intents[name] = MatchData(
-                name, sent, matches=perfect_match['entities'], conf=1.0)
-        return list(intents.values())
+        return self.calc_intents_batch([query])[0]
+
+    def calc_intents_batch(self, queries):
+        """
+        Tests all the intents against many queries at once. This returns
+        the same results as calling calc_intents() on each query but
+        evaluates each network over the whole batch
+
+        Args:
+            queries (list<str>): Input sentences to test against intents
+        Returns:
+            list<list<MatchData>>: List of intent matches for each query
+        """
+        return self._calc_intents_batch(queries)
+
+    def _calc_intents_batch(self, queries, best_only=False):
+        """
+        With best_only, only matches that could be the best one are returned:
+        intents are matched best-first and each shard sends its best matches.
+        Padaos runs on every query since its entities keep the case of the
+        query, so the result cache only holds the matches of the networks
+        """
+        models = self.snapshot()
+        exhaustive = self.exhaustive or not best_only
+        training = not self.hold_models and self.train_thread and self.train_thread.is_alive()
+        use_cache = self.result_cache is not None and not training
+
+        perfect_matches = [list(models.padaos.calc_intents(query)) for query in queries]
+        # Perfect matches score 1.0 and replace the intents they are for
+        names = [{i['name'] for i in perfect} for perfect in perfect_matches]
+        floors = [self._perfect_floor(perfect) for perfect in perfect_matches]
+
+        results = [None] * len(queries)
+        if use_cache:
+            # What padaos found changes which matches best_only returns
+            keys = [(tuple(tokenize(query)), best_only) +
+                    ((frozenset(names[n]), floors[n]) if best_only else ())
+                    for n, query in enumerate(queries)]
+            for n, key in enumerate(keys):
+                cached = self.result_cache.get(key)
+                if cached is not None:
+                    results[n] = [i.copy() for i in cached]
+        todo = [n for n, result in enumerate(results) if result is None]
+
+        if training:
+            all_matches = [[] for _ in todo]
+        elif best_only and self.shards is not None:
+            # Queries settled by padaos are not sent to the shards at all
+            todo_shards = [n for n in todo if floors[n] < math.inf]
+            found = self.shards.calc_intents_batch(
+                [queries[n] for n in todo_shards], models, best_only, exhaustive,
+                [names[n] for n in todo_shards], [floors[n] for n in todo_shards]
+            ) if todo_shards else []
+            found = dict(zip(todo_shards, found))
+            all_matches = [found[n] if n in found else [
+                MatchData(i.name, []) for i in models.intents.intents if i.name in names[n]
+            ] for n in todo]
+        elif best_only:
+            all_matches = [
+                # Placeholders keep the position of the intents replaced below
+                [MatchData(name, []) if match is None else match for name, match in found
+                 if match is not None or name in names[n]]
+                for n, found in zip(todo, models.intents.calc_best_batch(
+                    [queries[n] for n in todo], models.entities, exhaustive,
+                    [names[n] for n in todo], [floors[n] for n in todo]))
+            ]
+        elif self.shards is not None:
+            all_matches = self.shards.calc_intents_batch([queries[n] for n in todo], models,
+                                                         best_only, exhaustive)
+        else:
+            all_matches = models.intents.calc_intents_batch([queries[n] for n in todo],
+                                                            models.entities, exhaustive)
+
+        for n, matches in zip(todo, all_matches):
+            results[n] = matches
+            if use_cache and models is self.models:
+                self.result_cache.put(keys[n], [i.copy() for i in matches])
+
+        for n, (query, perfect) in enumerate(zip(queries, perfect_matches)):
+            intents = {i.name: i for i in results[n]}
+            sent = None
+            for perfect_match in perfect:
+                name = perfect_match['name']
+                sent = sent or tokenize(query)
+                intents[name] = MatchData(
+                    name, sent, matches=perfect_match['entities'], conf=1.0)
+            results[n] = list(intents.values())
+        return results
 
     def calc_intent(self, query):
         """
         Tests all the intents against the query and returns
-        match data of the best intent
+        match data of the best intent. Intents are matched best-first
+        by an upper bound of their confidence so ones that cannot beat
+        the best match so far are never run through entity extraction.
+        Padaos perfect matches are found first: one without entities
+        cannot be beaten so the networks are skipped, and one with
+        entities only leaves intents with entities to tie it
 
         Args:
             query (str): Input sentence to test against intents
         Returns:
             MatchData: Best intent match
         """
-        matches = self.calc_intents(query)
+        return self.calc_intent_batch([query])[0]
+
+    async def calc_intents_async(self, query):
+        """
+        Same as calc_intents() but matches in an executor so the event
+        loop keeps running. With batch_window, queries awaited within the
+        window are matched together by calc_intents_batch()
+        """
+        if self.batcher is not None:
+            return await self.batcher.match(query)
+        return await asyncio.get_event_loop().run_in_executor(None, self.calc_intents, query)
+
+    async def calc_intent_async(self, query):
+        """Same as calc_intent() but without blocking the event loop (see calc_intents_async)"""
+        if self.best_batcher is not None:
+            return await self.best_batcher.match(query)
+        return await asyncio.get_event_loop().run_in_executor(None, self.calc_intent, query)
+
+    def calc_intent_batch(self, queries):
+        """
+        Finds the best intent for each of the queries
+
+        Args:
+            queries (list<str>): Input sentences to test against intents
+        Returns:
+            list<MatchData>: Best intent match for each query
+        """
+        return [self._best_match(i) for i in self._calc_intents_batch(queries, best_only=True)]
+
+    @staticmethod
+    def _perfect_floor(perfect_matches):
+        """
+        Confidence a neural match needs to change the best match of a query
+        with these padaos perfect matches. Neural confidences are at most
+        1.0 and only reach it with extracted entities, so they cannot win
+        the entity length tie-break against a perfect match without any
+        """
+        if not perfect_matches:
+            return -math.inf
+        if any(sum(map(len, i['entities'].values())) == 0 for i in perfect_matches):
+            return math.inf
+        return 1.0
+
+    @staticmethod
+    def _best_match(matches):
         if len(matches) == 0:
             return MatchData('', '')
         best_match = max(matches, key=lambda x: x.conf)
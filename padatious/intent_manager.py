@@ -11,22 +11,202 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import math
+
+import numpy as np
 
 from padatious.intent import Intent
+from padatious.intent_bank import IntentBank
 from padatious.match_data import MatchData
 from padatious.training_manager import TrainingManager
 from padatious.util import tokenize
 
 
+class IntentSet(object):
+    """
+    Fixed list of intents with an IntentBank compiled for them. Neither
+    is changed afterwards so any number of threads can match with it
+
+    Unless matching is exhaustive, only intents that share a token with a
+    query, or have entities that could take its unknown tokens, are
+    matched against it. The rest would score close to zero anyway
+
+    Args:
+        intents (list<Intent>): Intents to match
+        bank (IntentBank): Compiled bank of the intents
+    """
+    def __init__(self, intents, bank):
+        self.intents = intents
+        self.bank = bank
+        # Lazy intents without a block in the bank, matched on their own
+        self.unscored = [i for i in intents if not getattr(i, 'loaded', True)]
+
+    def calc_intents_batch(self, queries, entity_manager, exhaustive=True):
+        """
+        Matches the intents against a list of queries
+
+        Args:
+            queries (list<str>): Input sentences to test against intents
+            entity_manager (EntityManager): Entities used for extraction
+                (or an EntitySet)
+            exhaustive (bool): Match every intent instead of only the candidates
+        Returns:
+            list<list<MatchData>>: Intent matches for each query
+        """
+        sents = [tokenize(query) for query in queries]
+        bank_confs = self.bank.score_batch(sents)
+        bank_columns = {name: i for i, name in enumerate(self.bank.names)}
+        if not exhaustive:
+            known = self.bank.known_counts(sents)
+            lengths = np.array([len(sent) for sent in sents])
+
+        memo = entity_manager.memo() if entity_manager else None
+
+        matches = [[] for _ in sents]
+        for i in self.intents:
+            column = bank_columns.get(i.name)
+            if exhaustive or column is None:
+                rows = range(len(sents))
+            else:
+                candidates = known[:, column] > 0
+                if i.pos_intents:
+                    candidates |= known[:, column] < lengths
+                rows = np.flatnonzero(candidates).tolist()
+                if not rows:
+                    continue
+            simple_confs = None if column is None else bank_confs[rows, column].tolist()
+            for row, match in zip(rows, i.match_batch([sents[row] for row in rows],
+                                                      entity_manager, simple_confs, memo)):
+                match.detokenize()
+                matches[row].append(match)
+        return matches
+
+    def calc_best_batch(self, queries, entity_manager, exhaustive=True, skip=None, floors=None):
+        """
+        Matches the intents best-first, stopping once no other intent can
+        reach the best confidence so far. An intent without entities
+        scores exactly sqrt(0.5 * simple_conf) and the extractions of one
+        with entities at most sqrt(upper_bound) (see IntentBank.upper_bounds)
+        since the entity part of the confidence is at most 1
+
+        The networks are only run for sentences that need them: with a
+        floor of 1.0 only intents with entities can still tie, and with an
+        infinite floor no intent is matched at all
+
+        Args:
+            queries (list<str>): Input sentences to test against intents
+            entity_manager (EntityManager): Entities used for extraction
+                (or an EntitySet)
+            exhaustive (bool): Consider every intent instead of only the candidates
+            skip (list<set<str>>): Intents not to match for each query
+            floors (list<float>): Confidence each query already reached elsewhere
+        Returns:
+            list<list<tuple<str, MatchData>>>: (name, match) of each intent
+                calc_intents_batch would match, in the same order, with None
+                for the ones that could not beat the best match
+        """
+        sents = [tokenize(query) for query in queries]
+        skip = skip or [set() for _ in sents]
+        floors = floors or [-math.inf for _ in sents]
+        # Empty sentences stand in for the ones a score is not needed for
+        scored = [floor < 1.0 for floor in floors]
+        bank_confs = self.bank.score_batch([
+            sent if score else [] for sent, score in zip(sents, scored)
+        ]).tolist()
+        bounds = self.bank.upper_bounds([
+            sent if floor <= 1.0 else [] for sent, floor in zip(sents, floors)
+        ]).tolist()
+        bank_columns = {name: i for i, name in enumerate(self.bank.names)}
+        if not exhaustive:
+            known = self.bank.known_counts(sents).tolist()
+
+        memo = entity_manager.memo() if entity_manager else None
+
+        results = []
+        for row, sent in enumerate(sents):
+            candidates = []  # (bound, intent, simple_conf)
+            for i in self.intents:
+                column = bank_columns.get(i.name)
+                if column is None:
+                    candidates.append((math.inf, i, None))
+                    continue
+                if not exhaustive:
+                    count = known[row][column]
+                    if not (count > 0 or i.pos_intents and count < len(sent)):
+                        continue
+                if scored[row]:
+                    simple_conf = bank_confs[row][column]
+                    bound = math.sqrt(0.5 * simple_conf)
+                else:
+                    simple_conf, bound = None, math.sqrt(0.5)
+                if i.pos_intents and sent:
+                    bound = max(bound, math.sqrt(bounds[row][column]))
+                candidates.append((bound, i, simple_conf))
+
+            best, found = floors[row], {}
+            for bound, i, simple_conf in sorted(candidates, key=lambda x: -x[0]):
+                if bound < best or best == math.inf:
+                    break
+                if i.name in skip[row]:
+                    continue
+                simple_confs = None if simple_conf is None else [simple_conf]
+                match = i.match_batch([sent], entity_manager, simple_confs, memo)[0]
+                match.detokenize()
+                found[i.name] = match
+                best = max(best, match.conf)
+            results.append([(i.name, found.get(i.name)) for _, i, _ in candidates])
+        return results
+
+
 class IntentManager(TrainingManager):
-    def __init__(self, cache):
-        super(IntentManager, self).__init__(Intent, cache)
+    def __init__(self, cache, **kwargs):
+        super(IntentManager, self).__init__(Intent, cache, **kwargs)
+        self.bank = IntentBank()
+        self.intent_set = IntentSet([], self.bank)
+
+    def snapshot(self, with_bank=True):
+        """
+        IntentSet of the loaded intents. The bank is copied and updated
+        when they change so sets handed out before stay the same. Lazy
+        intents join the bank once something else has loaded them
+
+        Args:
+            with_bank (bool): Build the bank. Without it, the set only
+                lists the intents for matching in other processes
+        """
+        with self.lock:
+            intents = list(self.objects)
+        if not with_bank:
+            return IntentSet(intents, None)
+        current = self.intent_set
+        if len(intents) == len(current.intents) and \
+                all(a is b for a, b in zip(intents, current.intents)) and \
+                not any(i.loaded for i in current.unscored):
+            return current
+        bank = self.bank.copy()
+        bank.update(intents)
+        if bank.must_compile:
+            bank.compile()
+        self.bank = bank
+        self.intent_set = IntentSet(intents, bank)
+        return self.intent_set
 
     def calc_intents(self, query, entity_manager):
-        sent = tokenize(query)
-        matches = []
-        for i in self.objects:
-            match = i.match(sent, entity_manager)
-            match.detokenize()
-            matches.append(match)
-        return matches
+        return self.calc_intents_batch([query], entity_manager)[0]
+
+    def calc_intents_batch(self, queries, entity_manager, exhaustive=True):
+        """
+        Matches the intents against a list of queries (see IntentSet)
+
+        Args:
+            queries (list<str>): Input sentences to test against intents
+            entity_manager (EntityManager): Entities used for extraction
+            exhaustive (bool): Match every intent instead of only the candidates
+        Returns:
+            list<list<MatchData>>: Intent matches for each query
+        """
+        return self.snapshot().calc_intents_batch(queries, entity_manager, exhaustive)
+
+    def calc_best_batch(self, queries, entity_manager, exhaustive=True, skip=None, floors=None):
+        """Matches the intents best-first (see IntentSet.calc_best_batch)"""
+        return self.snapshot().calc_best_batch(queries, entity_manager, exhaustive, skip, floors)
@@ -0,0 +1,133 @@
+# Copyright 2017 Mycroft AI, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+from collections.abc import Sequence
+from os.path import join
+
+import padatious
+from padatious.util import lines_hash
+
+
+class LazyLines(Sequence):
+    """
+    Stripped lines of a training file that are only read once
+    something iterates over them
+
+    Args:
+        filename (str): Training file
+        count (int): Number of lines in the file
+        hsh (str): lines_hash of the stripped lines as hex
+    """
+
+    def __init__(self, filename, count, hsh):
+        self.filename = filename
+        self.count = count
+        self.lines_hash = hsh
+        self.lines = None
+
+    def load(self):
+        if self.lines is None:
+            with open(self.filename, 'r') as f:
+                self.lines = [line.strip() for line in f]
+        return self.lines
+
+    def __getitem__(self, index):
+        return self.load()[index]
+
+    def __len__(self):
+        return self.count
+
+
+class Manifest(object):
+    """
+    Index of the trained intents and entities of a cache directory
+
+    For each one, manifest.json records the model hash along with the
+    name, size, modification time, line count and lines hash of its
+    training file so a warm start neither lists the directory nor
+    reads training files that padaos already has patterns for
+
+    Args:
+        cache_dir (str): Cache directory the manifest is stored in
+    """
+    VERSION = 1
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.filename = join(cache_dir, 'manifest.json')
+
+    def load(self):
+        """
+        Reads the manifest
+
+        Returns:
+            dict: {'intents': {name: record}, 'entities': {name: record}} or
+                None if it is missing, outdated or a training file changed
+        """
+        try:
+            with open(self.filename) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if data.get('version') != [self.VERSION, padatious.__version__]:
+            return None
+        for records in (data['intents'], data['entities']):
+            for record in records.values():
+                try:
+                    stat = os.stat(join(self.cache_dir, record['file']))
+                except OSError:
+                    return None
+                if [stat.st_size, stat.st_mtime_ns] != [record['size'], record['mtime']]:
+                    return None
+        return data
+
+    def record(self, file_name, obj, lines):
+        """
+        Manifest entry of a trained object
+
+        Args:
+            file_name (str): Training file name inside the cache directory
+            obj (Trainable): Object trained on the lines
+            lines (list<str>): Stripped lines of the file
+        """
+        stat = os.stat(join(self.cache_dir, file_name))
+        return {
+            'file': file_name, 'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+            'lines': len(lines), 'lines_hash': lines_hash(lines).hex(),
+            'hash': obj.hash.hex()
+        }
+
+    def lazy_lines(self, record):
+        return LazyLines(join(self.cache_dir, record['file']), record['lines'],
+                         record['lines_hash'])
+
+    def save(self, intents, entities):
+        """
+        Args:
+            intents (dict<str, dict>): Record of each intent
+            entities (dict<str, dict>): Record of each entity
+        """
+        data = {
+            'version': [self.VERSION, padatious.__version__],
+            'intents': intents, 'entities': entities
+        }
+        with open(self.filename + '.tmp', 'w') as f:
+            json.dump(data, f)
+        os.replace(self.filename + '.tmp', self.filename)
+
+    def remove(self):
+        if os.path.isfile(self.filename):
+            os.remove(self.filename)
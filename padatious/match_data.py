@@ -11,6 +11,7 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+from copy import deepcopy
 
 
 class MatchData(object):
@@ -42,6 +43,10 @@ class MatchData(object):
     def __repr__(self):
         return repr(self.__dict__)
 
+    def copy(self):
+        """Deep copy that can be modified without affecting the original"""
+        return deepcopy(self)
+
     @staticmethod
     def handle_apostrophes(old_sentence):
         """
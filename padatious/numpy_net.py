@@ -0,0 +1,249 @@
+# Copyright 2017 Mycroft AI, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+from itertools import chain
+from tempfile import mkstemp
+
+import numpy as np
+
+LINEAR = 0
+SIGMOID_STEPWISE = 4
+SIGMOID_SYMMETRIC_STEPWISE = 6
+
+# Breakpoints and values of fann's piecewise linear sigmoid approximations
+_STEPWISE = {
+    SIGMOID_STEPWISE: (
+        [-2.64665246009826660156e+00, -1.47221946716308593750e+00, -5.49306154251098632812e-01,
+         5.49306154251098632812e-01, 1.47221934795379638672e+00, 2.64665293693542480469e+00],
+        [4.99999988824129104614e-03, 5.00000007450580596924e-02, 2.50000000000000000000e-01,
+         7.50000000000000000000e-01, 9.49999988079071044922e-01, 9.95000004768371582031e-01],
+        0.0, 1.0
+    ),
+    SIGMOID_SYMMETRIC_STEPWISE: (
+        [-2.64665293693542480469e+00, -1.47221934795379638672e+00, -5.49306154251098632812e-01,
+         5.49306154251098632812e-01, 1.47221934795379638672e+00, 2.64665293693542480469e+00],
+        [-9.90000009536743164062e-01, -8.99999976158142089844e-01, -5.00000000000000000000e-01,
+         5.00000000000000000000e-01, 8.99999976158142089844e-01, 9.90000009536743164062e-01],
+        -1.0, 1.0
+    )
+}
+
+_HEADER = '''FANN_FLO_2.1
+num_layers={num_layers}
+learning_rate=0.700000
+connection_rate=1.000000
+network_type=0
+learning_momentum=0.000000
+training_algorithm=2
+train_error_function=1
+train_stop_function=1
+cascade_output_change_fraction=0.010000
+quickprop_decay=-0.000100
+quickprop_mu=1.750000
+rprop_increase_factor=1.200000
+rprop_decrease_factor=0.500000
+rprop_delta_min=0.000000
+rprop_delta_max=50.000000
+rprop_delta_zero=0.100000
+cascade_output_stagnation_epochs=12
+cascade_candidate_change_fraction=0.010000
+cascade_candidate_stagnation_epochs=12
+cascade_max_out_epochs=150
+cascade_min_out_epochs=50
+cascade_max_cand_epochs=150
+cascade_min_cand_epochs=50
+cascade_num_candidate_groups=2
+bit_fail_limit=1.00000001490116119385e-01
+cascade_candidate_limit=1.00000000000000000000e+03
+cascade_weight_multiplier=4.00000005960464477539e-01
+cascade_activation_functions_count=10
+cascade_activation_functions=3 5 7 8 10 11 14 15 16 17
+cascade_activation_steepnesses_count=4
+cascade_activation_steepnesses={cascade_steepnesses}
+layer_sizes={layer_sizes}
+scale_included=0
+'''
+
+
+def activate(func, x):
+    """Applies a fann activation function to an array of (steepened) sums"""
+    if func == LINEAR:
+        return x
+    if func not in _STEPWISE:
+        raise ValueError('Unsupported activation function: {}'.format(func))
+    points, values, low, high = _STEPWISE[func]
+    y = np.interp(x, points, values).astype(np.float32)
+    y[x < points[0]] = low
+    y[x >= points[-1]] = high
+    return y
+
+
+def _parse_numbers(line):
+    return np.array(re.findall(r'[-+]?[0-9.]+(?:[eE][-+]?[0-9]+)?', line.split('=', 1)[1]),
+                    dtype=np.float64)
+
+
+class NumpyNet(object):
+    """
+    Fully connected feed forward network evaluated with NumPy
+    Reads the weights of trained fann networks so inference does not
+    require fann. Outputs match fann's within TOLERANCE
+
+    Args:
+        weights (list<np.ndarray>): Input x output weight matrix of each layer
+        biases (list<np.ndarray>): Bias vector of each layer
+        activations (list<int>): fann activation function of each layer
+        steepnesses (list<np.ndarray>): Activation steepness of each neuron
+    """
+    TOLERANCE = 1e-5
+
+    def __init__(self, weights, biases, activations, steepnesses):
+        self.weights = weights
+        self.biases = biases
+        self.activations = activations
+        self.steepnesses = steepnesses
+
+    @property
+    def num_inputs(self):
+        return self.weights[0].shape[0]
+
+    def run_batch(self, inputs):
+        """
+        Runs the network on every row of inputs
+
+        Args:
+            inputs (np.ndarray): Matrix of shape (samples, num_inputs)
+        Returns:
+            np.ndarray: Matrix of shape (samples, num_outputs)
+        """
+        x = np.asarray(inputs, dtype=np.float32).reshape(-1, self.num_inputs)
+        return self.forward(x, 0)
+
+    def run_sparse_batch(self, vectors):
+        """
+        Runs the network on sparse inputs without building dense rows
+
+        Args:
+            vectors (list<dict<int, float>>): {input index: value} of each sample
+        Returns:
+            np.ndarray: Matrix of shape (samples, num_outputs)
+        """
+        lengths = [len(v) for v in vectors]
+        total = sum(lengths)
+        indices = np.fromiter(chain.from_iterable(vectors), np.int64, total)
+        values = np.fromiter(chain.from_iterable(v.values() for v in vectors), np.float32, total)
+        rows = np.repeat(np.arange(len(vectors)), lengths)
+
+        weights = self.weights[0]
+        num_hidden = weights.shape[1]
+        columns = (rows[:, None] * num_hidden + np.arange(num_hidden)).ravel()
+        sums = np.bincount(columns, (weights[indices] * values[:, None]).ravel(),
+                           minlength=len(vectors) * num_hidden)
+        sums = sums.reshape(len(vectors), num_hidden).astype(np.float32)
+        return self.forward(self.activate(0, sums + self.biases[0]), 1)
+
+    def forward(self, x, layer):
+        """Continues a forward pass with the inputs of the given layer"""
+        for i in range(layer, len(self.weights)):
+            x = self.activate(i, x.dot(self.weights[i]) + self.biases[i])
+        return x
+
+    def activate(self, layer, sums):
+        """Applies steepness and activation of a layer to its neuron sums"""
+        sums = sums * self.steepnesses[layer]
+        np.clip(sums, -150.0, 150.0, out=sums)
+        return activate(self.activations[layer], sums)
+
+    def run(self, inputs):
+        """Same as fann's run(): one input vector to a list of outputs"""
+        return self.run_batch(inputs)[0].tolist()
+
+    @classmethod
+    def from_file(cls, filename):
+        """Loads a network saved by fann (FANN_FLO_2.1 format)"""
+        lines = {}
+        with open(filename, 'r') as f:
+            for line in f:
+                key = line.split('=', 1)[0]
+                lines[key.split(' ', 1)[0]] = line
+        if 'layer_sizes' not in lines or 'connections' not in lines:
+            raise ValueError('Invalid fann network file: ' + filename)
+
+        sizes = [int(i) for i in lines['layer_sizes'].split('=', 1)[1].split()]
+        neurons = _parse_numbers(lines['neurons']).reshape(-1, 3)
+        connections = _parse_numbers(lines['connections']).reshape(-1, 2)
+
+        weights, biases, activations, steepnesses = [], [], [], []
+        first_neuron = sizes[0]
+        first_con = 0
+        prev_first = 0
+        for prev_size, size in zip(sizes, sizes[1:]):
+            layer_neurons = neurons[first_neuron:first_neuron + size - 1]
+            num_cons = (size - 1) * prev_size
+            cons = connections[first_con:first_con + num_cons].reshape(size - 1, prev_size, 2)
+            if (np.any(layer_neurons[:, 0] != prev_size) or
+                    np.any(cons[:, :, 0] != np.arange(prev_first, prev_first + prev_size))):
+                raise ValueError('Only fully connected fann networks are supported')
+            if np.any(layer_neurons[:, 1] != layer_neurons[0, 1]):
+                raise ValueError('Mixed activation functions in one layer are not supported')
+
+            weights.append(np.ascontiguousarray(cons[:, :-1, 1].T, dtype=np.float32))
+            biases.append(cons[:, -1, 1].astype(np.float32))
+            activations.append(int(layer_neurons[0, 1]))
+            steepnesses.append(layer_neurons[:, 2].astype(np.float32))
+
+            prev_first = first_neuron
+            first_neuron += size
+            first_con += num_cons
+        return cls(weights, biases, activations, steepnesses)
+
+    @classmethod
+    def from_fann(cls, net):
+        """Copies the weights out of a live fann.neural_net"""
+        fd, filename = mkstemp(suffix='.net')
+        os.close(fd)
+        try:
+            net.save(str(filename))  # Must have str()
+            return cls.from_file(filename)
+        finally:
+            os.remove(filename)
+
+    def save(self, filename):
+        """Writes the network in fann's format"""
+        sizes = [self.num_inputs + 1] + [len(b) + 1 for b in self.biases]
+        neurons = ['(0, 0, 0.00000000000000000000e+00) '] * sizes[0]
+        connections = []
+        first_neuron = 0
+        for w, b, func, steep, prev_size in zip(self.weights, self.biases, self.activations,
+                                                self.steepnesses, sizes):
+            for j in range(len(b)):
+                neurons.append('({}, {}, {:.20e}) '.format(prev_size, func, steep[j]))
+                for i in range(prev_size - 1):
+                    connections.append('({}, {:.20e}) '.format(first_neuron + i, w[i, j]))
+                connections.append('({}, {:.20e}) '.format(first_neuron + prev_size - 1, b[j]))
+            neurons.append('(0, {}, {:.20e}) '.format(func, steep[0]))
+            first_neuron += prev_size
+
+        with open(filename, 'w') as f:
+            f.write(_HEADER.format(
+                num_layers=len(sizes),
+                cascade_steepnesses=' '.join('{:.20e}'.format(i) for i in (0.25, 0.5, 0.75, 1.0)),
+                layer_sizes=''.join('{} '.format(i) for i in sizes)
+            ))
+            f.write('neurons (num_inputs, activation_function, activation_steepness)=')
+            f.write(''.join(neurons) + '\n')
+            f.write('connections (connected_to_neuron, weight)=')
+            f.write(''.join(connections) + '\n')
@@ -0,0 +1,223 @@
+# Copyright 2017 Mycroft AI, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import mmap
+import os
+import struct
+import sys
+from bisect import bisect_left
+from collections.abc import Mapping
+
+import numpy as np
+from xxhash import xxh64
+
+from padatious.numpy_net import NumpyNet
+
+MAGIC = b'PADPACK\0'
+FORMAT_VERSION = 2
+ALIGNMENT = 16
+
+# Magic, format version and header length
+_PREFIX = struct.Struct('<8sIQ')
+
+
+def _token_hash(token):
+    return xxh64(token.encode()).intdigest()
+
+
+class PackWriter(object):
+    """
+    Collects the records of trained objects and their weights to
+    write a whole cache as a single file. The file starts with a JSON
+    index header followed by aligned, contiguous binary blocks holding
+    the weights and vocabularies
+    """
+
+    def __init__(self):
+        self.records = {}
+        self.arrays = []
+        self.size = 0
+
+    def add_array(self, array):
+        """Queues a block and returns its [offset, shape, type] reference"""
+        array = np.ascontiguousarray(array)
+        ref = [self.size, list(array.shape), array.dtype.char]
+        padding = -array.nbytes % ALIGNMENT
+        self.arrays.append(array.tobytes() + b'\0' * padding)
+        self.size += array.nbytes + padding
+        return ref
+
+    def add_net(self, net):
+        def add(array):
+            return self.add_array(np.asarray(array, dtype=np.float32))
+
+        return {
+            'activations': list(net.activations),
+            'weights': [add(i) for i in net.weights],
+            'biases': [add(i) for i in net.biases],
+            'steepnesses': [add(i) for i in net.steepnesses]
+        }
+
+    def add_vocab(self, ids):
+        """Stores a token -> index dict as blocks sorted by token hash"""
+        tokens = list(ids)
+        hashes = np.array([_token_hash(i) for i in tokens], dtype=np.uint64)
+        order = np.argsort(hashes, kind='stable')
+        encoded = [tokens[i].encode() for i in order]
+        offsets = np.concatenate([[0], np.cumsum([len(i) for i in encoded])])
+        return {
+            'hashes': self.add_array(hashes[order]),
+            'indices': self.add_array(np.array([ids[tokens[i]] for i in order], dtype=np.int32)),
+            'offsets': self.add_array(offsets.astype(np.uint32)),
+            'blob': self.add_array(np.frombuffer(b''.join(encoded), dtype=np.uint8))
+        }
+
+    def save(self, filename):
+        header = json.dumps({'byteorder': sys.byteorder, 'objects': self.records}).encode()
+        padding = -(_PREFIX.size + len(header)) % ALIGNMENT
+        temp_name = filename + '.tmp'
+        with open(temp_name, 'wb') as f:
+            f.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)))
+            f.write(header)
+            f.write(b'\0' * padding)
+            for array in self.arrays:
+                f.write(array)
+        os.replace(temp_name, filename)
+
+
+class PackedVocab(Mapping):
+    """
+    Read only token -> index mapping stored in a packed cache
+    Tokens are found by binary search over their sorted hashes so
+    a memory mapped vocabulary is never copied into a dict
+
+    Args:
+        hashes (memoryview): Sorted xxh64 hash of each token
+        indices (memoryview): Index of each token
+        offsets (memoryview): Start of each token in blob (and the end)
+        blob (memoryview): utf-8 encoded tokens
+    """
+
+    def __init__(self, hashes, indices, offsets, blob):
+        self.hashes = hashes
+        self.indices = indices
+        self.offsets = offsets
+        self.blob = blob
+
+    def find(self, token):
+        """Position of the token in the sorted blocks or -1"""
+        hsh = _token_hash(token)
+        encoded = token.encode()
+        i = bisect_left(self.hashes, hsh)
+        while i < len(self.hashes) and self.hashes[i] == hsh:
+            if self.blob[self.offsets[i]:self.offsets[i + 1]] == encoded:
+                return i
+            i += 1
+        return -1
+
+    def __getitem__(self, token):
+        i = self.find(token)
+        if i < 0:
+            raise KeyError(token)
+        return self.indices[i]
+
+    def get(self, token, default=None):
+        i = self.find(token)
+        return default if i < 0 else self.indices[i]
+
+    def __contains__(self, token):
+        return self.find(token) >= 0
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __iter__(self):
+        for i in range(len(self.hashes)):
+            yield bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode()
+
+
+class PackedCache(object):
+    """
+    Read side of a file written by PackWriter
+
+    Args:
+        records (dict): Record of each object by name
+        buffer: Bytes (or mmap) of the file that blocks are read from
+        data_start (int): Offset of the first block in buffer
+    """
+
+    def __init__(self, records=None, buffer=b'', data_start=0):
+        self.records = records or {}
+        self.buffer = buffer
+        self.data_start = data_start
+        self.mapped = isinstance(buffer, mmap.mmap)
+
+    def get(self, name):
+        return self.records.get(name)
+
+    def __contains__(self, name):
+        return name in self.records
+
+    @classmethod
+    def load(cls, filename, use_mmap=False):
+        """
+        Reads a packed cache with a single read or, with use_mmap, maps
+        it read only so processes loading the same file share its pages
+        """
+        with open(filename, 'rb') as f:
+            if use_mmap:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                buffer = f.read()
+        return cls.from_buffer(buffer)
+
+    @classmethod
+    def from_buffer(cls, buffer):
+        if len(buffer) < _PREFIX.size:
+            raise ValueError('Packed cache is truncated')
+        magic, version, header_len = _PREFIX.unpack_from(buffer)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError('Not a packed cache of version {}'.format(FORMAT_VERSION))
+        header_end = _PREFIX.size + header_len
+        header = json.loads(bytes(buffer[_PREFIX.size:header_end]).decode())
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError('Packed cache was written on a different architecture')
+        data_start = header_end + -header_end % ALIGNMENT
+        return cls(header['objects'], buffer, data_start)
+
+    def array(self, ref):
+        """Read only view of a block"""
+        offset, shape, dtype = ref
+        return np.frombuffer(self.buffer, np.dtype(dtype), int(np.prod(shape)),
+                             self.data_start + offset).reshape(shape)
+
+    def view(self, ref):
+        offset, shape, dtype = ref
+        start = self.data_start + offset
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        return memoryview(self.buffer)[start:start + size].cast(dtype)
+
+    def net(self, record):
+        return NumpyNet(
+            [self.array(i) for i in record['weights']],
+            [self.array(i) for i in record['biases']],
+            record['activations'],
+            [self.array(i) for i in record['steepnesses']]
+        )
+
+    def vocab(self, record):
+        """Token -> index mapping. Stays in the mapped file when memory mapped"""
+        vocab = PackedVocab(*[self.view(record[i]) for i in ('hashes', 'indices', 'offsets', 'blob')])
+        return vocab if self.mapped else dict(zip(vocab, vocab.indices))
@@ -0,0 +1,146 @@
+# Copyright 2017 Mycroft AI, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import re
+
+import padaos
+
+from padatious.util import lines_hash
+
+FORMAT_VERSION = 1
+
+
+def _padaos_version():
+    """
+    Version of the padaos code the saved patterns were created by. They
+    come from its private pattern generation so any change invalidates them
+    """
+    version = getattr(padaos, '__version__', None)
+    if version:
+        return version
+    with open(padaos.__file__, 'rb') as f:
+        return lines_hash([f.read().decode('utf-8', 'replace')]).hex()
+
+
+PADAOS_VERSION = _padaos_version()
+
+
+def _lines_hash(lines):
+    """Hex lines_hash, taken from LazyLines without reading them"""
+    return getattr(lines, 'lines_hash', None) or lines_hash(lines).hex()
+
+
+class LazyRegex(object):
+    """Padaos regex pattern that is only compiled the first time it is matched"""
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.regex = None
+
+    def match(self, query):
+        if self.regex is None:
+            self.regex = re.compile(self.pattern, re.IGNORECASE)
+        return self.regex.match(query)
+
+
+class PadaosCache(padaos.IntentContainer):
+    """
+    padaos.IntentContainer that saves the patterns it compiles to a file
+
+    Patterns of entities and intents whose lines hash the same as when
+    they were saved are read back instead of being generated again and
+    are only compiled by re when first matched against a query
+
+    Args:
+        filename (str): File to save compiled patterns to
+    """
+
+    def __init__(self, filename):
+        super(PadaosCache, self).__init__()
+        self.filename = filename
+        self.saved = self.read()
+
+    def read(self):
+        try:
+            with open(self.filename) as f:
+                saved = json.load(f)
+        except (IOError, ValueError):
+            return {}
+        if saved.get('version') != FORMAT_VERSION or saved.get('padaos') != PADAOS_VERSION:
+            return {}
+        return saved
+
+    def save(self, state):
+        temp_name = self.filename + '.tmp'
+        with open(temp_name, 'w') as f:
+            json.dump(state, f)
+        os.replace(temp_name, self.filename)
+
+    def snapshot(self):
+        """Compiled patterns as a container that adding intents does not change"""
+        with self.compile_lock:
+            if self.must_compile:
+                self._compile()
+            frozen = padaos.IntentContainer()
+            frozen.intents, frozen.entities = self.intents, self.entities
+            frozen.must_compile = False
+        return frozen
+
+    def _compile(self):
+        saved_entities = self.saved.get('entities', {})
+        saved_intents = self.saved.get('intents', {})
+        state = {'version': FORMAT_VERSION, 'padaos': PADAOS_VERSION,
+                 'entities': {}, 'intents': {}}
+
+        # Patterns are swapped in as whole dicts for threads matching queries
+        entities = {}
+        for name, lines in self.entity_lines.items():
+            hsh = _lines_hash(lines)
+            record = saved_entities.get(name)
+            if record and record['hash'] == hsh:
+                pattern = record['pattern']
+            else:
+                pattern = r'({})'.format('|'.join(
+                    self._create_pattern(line) for line in lines if line.strip()
+                ))
+            entities[name] = pattern
+            state['entities'][name] = {'hash': hsh, 'pattern': pattern}
+        self.entities = entities
+
+        # Entity patterns are inlined into intent patterns
+        entities_hash = lines_hash(sorted(
+            name + ':' + record['hash'] for name, record in state['entities'].items()
+        )).hex()
+
+        intents = {}
+        for name, lines in self.intent_lines.items():
+            hsh = _lines_hash(lines)
+            record = saved_intents.get(name)
+            if record and record['hash'] == hsh and record['entities'] == entities_hash:
+                regexes = [LazyRegex(i) for i in record['patterns']]
+            else:
+                regexes = self.create_regexes(lines, name)
+            intents[name] = regexes
+            state['intents'][name] = {
+                'hash': hsh, 'entities': entities_hash,
+                'patterns': [i.pattern for i in regexes]
+            }
+        self.intents = intents
+
+        self.must_compile = False
+        if state != self.saved:
+            self.save(state)
+            self.saved = state
@@ -26,41 +26,57 @@ class PosIntent(object):
     Args:
         token (str): token to attach to (something like {word})
     """
+    MIN_EDGE_CONF = 0.2
+    MAX_EDGES = None  # Most confident left and right edges tried (None for all)
+    MAX_SPAN = None  # Maximum number of tokens in an extracted entity (None for any)
 
     def __init__(self, token, intent_name=''):
         self.token = token
         self.edges = [EntityEdge(-1, token, intent_name), EntityEdge(+1, token, intent_name)]
 
-    def match(self, orig_data, entity=None):
-        l_matches = [(self.edges[0].match(orig_data.sent, pos), pos)
-                     for pos in range(len(orig_data.sent))]
-        r_matches = [(self.edges[1].match(orig_data.sent, pos), pos)
-                     for pos in range(len(orig_data.sent))]
+    def best_edges(self, confs):
+        """(conf, pos) of the edges worth trying, in sentence order"""
+        matches = [(conf, pos) for pos, conf in enumerate(confs.tolist())
+                   if conf >= self.MIN_EDGE_CONF]
+        if self.MAX_EDGES is not None and len(matches) > self.MAX_EDGES:
+            matches = sorted(matches, key=lambda x: -x[0])[:self.MAX_EDGES]
+            matches.sort(key=lambda x: x[1])
+        return matches
+
+    def match(self, orig_data, entity=None, memo=None):
+        sent = orig_data.sent
+        l_matches = self.best_edges(self.edges[0].match_all(sent))
+        r_matches = self.best_edges(self.edges[1].match_all(sent))
+
+        # Number of entity tokens before each position
+        braces = [0]
+        for token in sent:
+            braces.append(braces[-1] + token.startswith('{'))
 
         def is_valid(l_pos, r_pos):
             if r_pos < l_pos:
                 return False
-            for p in range(l_pos, r_pos + 1):
-                if orig_data.sent[p].startswith('{'):
-                    return False
-            return True
+            if self.MAX_SPAN is not None and r_pos - l_pos >= self.MAX_SPAN:
+                return False
+            return braces[r_pos + 1] == braces[l_pos]
 
         possible_matches = []
         for l_conf, l_pos in l_matches:
-            if l_conf < 0.2:
-                continue
             for r_conf, r_pos in r_matches:
-                if r_conf < 0.2:
-                    continue
                 if not is_valid(l_pos, r_pos):
                     continue
 
-                extracted = orig_data.sent[l_pos:r_pos + 1]
+                extracted = sent[l_pos:r_pos + 1]
 
                 pos_conf = (l_conf - 0.5 + r_conf - 0.5) / 2 + 0.5
-                ent_conf = (entity.match(extracted) if entity else 1)
-
-                new_sent = orig_data.sent[:l_pos] + [self.token] + orig_data.sent[r_pos + 1:]
+                if entity is None:
+                    ent_conf = 1
+                elif memo is not None:
+                    ent_conf = memo.match(entity, extracted)
+                else:
+                    ent_conf = entity.match(extracted)
+
+                new_sent = sent[:l_pos] + [self.token] + sent[r_pos + 1:]
                 new_matches = orig_data.matches.copy()
                 new_matches[self.token] = extracted
 
@@ -83,6 +99,16 @@ class PosIntent(object):
             i.load(prefix)
         return self
 
+    def pack(self, writer):
+        return {'token': self.token, 'edges': [i.pack(writer) for i in self.edges]}
+
+    @classmethod
+    def from_pack(cls, record, pack):
+        self = cls(record['token'])
+        for edge, edge_record in zip(self.edges, record['edges']):
+            edge.unpack(edge_record, pack)
+        return self
+
     def train(self, train_data):
         for i in self.edges:
             i.train(train_data)
@@ -0,0 +1,77 @@
+# Copyright 2017 Mycroft AI, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+from functools import partial
+
+
+class QueryBatcher(object):
+    """
+    Collects queries awaited on one event loop within a short window and
+    matches all of them with a single batched call in an executor so the
+    loop is never blocked by the networks
+
+    Args:
+        match_batch (Callable): Matches a list of queries, returning a result for each
+        window (float): Seconds to wait for more queries after the first one
+        executor (Executor): Executor to match in (None for the loop's default)
+    """
+    MAX_BATCH = 64  # Queries that are matched without waiting for the window
+
+    def __init__(self, match_batch, window, executor=None):
+        self.match_batch = match_batch
+        self.window = window
+        self.executor = executor
+        self.loop = None
+        self.pending = []  # (query, future) of each waiting query
+        self.timer = None
+
+    async def match(self, query):
+        """Result of match_batch for one query"""
+        loop = asyncio.get_event_loop()  # The running loop (get_running_loop needs 3.7)
+        if self.loop is not loop:
+            self.loop, self.pending, self.timer = loop, [], None
+        future = loop.create_future()
+        self.pending.append((query, future))
+        if len(self.pending) >= self.MAX_BATCH:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.window, self.flush)
+        return await future
+
+    def flush(self):
+        """Starts matching every waiting query"""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+        task = self.loop.run_in_executor(self.executor, self.match_batch, [q for q, _ in batch])
+        task.add_done_callback(partial(self._resolve, [f for _, f in batch]))
+
+    @staticmethod
+    def _resolve(futures, task):
+        if task.cancelled():
+            for future in futures:
+                future.cancel()
+            return
+        error = task.exception()
+        results = [None] * len(futures) if error else task.result()
+        for future, result in zip(futures, results):
+            if future.cancelled():
+                continue
+            if error:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
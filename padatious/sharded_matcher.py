@@ -0,0 +1,190 @@
+# Copyright 2017 Mycroft AI, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import multiprocessing as mp
+from threading import Lock
+
+from xxhash import xxh32
+
+from padatious.entity_manager import EntityManager
+from padatious.intent_manager import IntentManager
+from padatious.match_data import MatchData
+
+
+def _key(obj):
+    """(name, hex hash) a shard loads the same version of an object with"""
+    return obj.name, obj.hash.hex() if obj.hash else None
+
+
+def _best_matches(matches):
+    """Matches tied for the highest confidence"""
+    if not matches:
+        return []
+    best = max(i.conf for i in matches)
+    return [i for i in matches if i.conf == best]
+
+
+def _load(manager, loaded, keys):
+    objects = []
+    for name, hsh in keys:
+        if (name, hsh) not in loaded:
+            loaded[name, hsh] = manager.load_object(name, hsh and bytes.fromhex(hsh))
+        objects.append(loaded[name, hsh])
+    # Forget versions that are no longer used
+    for key in set(loaded) - set(keys):
+        del loaded[key]
+    return objects
+
+
+def _run_shard(conn, cache_dir, use_mmap):
+    """Main loop of a shard process"""
+    intents = IntentManager(cache_dir, use_mmap=use_mmap)
+    entities = EntityManager(cache_dir, use_mmap=use_mmap)
+    loaded_intents, loaded_entities = {}, {}
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        command, args = message
+        try:
+            if command == 'load':
+                intent_keys, entity_keys = args
+                # Read the packed cache again in case it was rewritten by training
+                intents.pack = entities.pack = None
+                intents.objects = _load(intents, loaded_intents, intent_keys)
+                entities.objects = _load(entities, loaded_entities, entity_keys)
+                entities.entity_dict = {}
+                entities.calc_ent_dict()
+                result = None
+            else:
+                queries, best_only, exhaustive, skip, floors = args
+                if best_only:
+                    skip = skip or [set() for _ in queries]
+                    result = intents.calc_best_batch(queries, entities, exhaustive, skip, floors)
+                    # Placeholders keep the position of the intents padaos replaces
+                    result = [_best_matches([i for _, i in found if i is not None]) +
+                              [MatchData(name, []) for name, i in found if name in names]
+                              for found, names in zip(result, skip)]
+                else:
+                    result = intents.calc_intents_batch(queries, entities, exhaustive)
+            conn.send((True, result))
+        except Exception as e:
+            conn.send((False, e))
+
+
+class ShardedMatcher(object):
+    """
+    Matches intents in several processes that each hold a slice of them.
+    Queries are sent to every shard and their matches are merged in the
+    order of the intents, so ties are broken as without shards.
+    Shards load the trained networks from the cache directory themselves,
+    which with use_mmap share one copy of the packed cache. Shards that
+    stopped are started again on the next query
+
+    Args:
+        cache_dir (str): Cache directory the intents were trained in
+        num_shards (int): Number of processes
+        use_mmap (bool): Memory map the packed cache in the shards
+    """
+
+    def __init__(self, cache_dir, num_shards, use_mmap=False):
+        self.cache_dir = cache_dir
+        self.num_shards = num_shards
+        self.use_mmap = use_mmap
+        self.conns = []
+        self.processes = []
+        self.models = None  # ModelSet the shards have loaded
+        self.order = {}  # Intent name -> position in the loaded ModelSet
+        self.lock = Lock()
+
+    def start(self):
+        # Spawned so no lock held by another thread is copied into the shards
+        context = mp.get_context('spawn')
+        for _ in range(self.num_shards):
+            conn, child_conn = context.Pipe()
+            process = context.Process(target=_run_shard, daemon=True,
+                                      args=(child_conn, self.cache_dir, self.use_mmap))
+            process.start()
+            child_conn.close()  # So reading from a shard that died fails
+            self.conns.append(conn)
+            self.processes.append(process)
+
+    def stop(self):
+        for conn, process in zip(self.conns, self.processes):
+            if process.is_alive():
+                try:
+                    conn.send(None)
+                except OSError:
+                    pass
+        for conn, process in zip(self.conns, self.processes):
+            process.join()
+            conn.close()
+        self.conns, self.processes, self.models = [], [], None
+
+    def close(self):
+        with self.lock:
+            self.stop()
+
+    def shard(self, name):
+        return xxh32(name.encode()).intdigest() % self.num_shards
+
+    def _request(self, messages):
+        try:
+            for conn, message in zip(self.conns, messages):
+                conn.send(message)
+            # Every reply is read before raising so none is left in a pipe
+            replies = [conn.recv() for conn in self.conns]
+        except (EOFError, OSError):
+            self.stop()
+            raise RuntimeError('A shard process stopped while matching')
+        for ok, result in replies:
+            if not ok:
+                raise result
+        return [result for _, result in replies]
+
+    def load(self, models):
+        """Sends each shard the intents it matches and every entity"""
+        intent_keys = [[] for _ in range(self.num_shards)]
+        for intent in models.intents.intents:
+            intent_keys[self.shard(intent.name)].append(_key(intent))
+        entity_keys = [_key(i) for i in models.entities.entity_dict.values()]
+        self._request([('load', (keys, entity_keys)) for keys in intent_keys])
+        self.models = models
+        self.order = {intent.name: n for n, intent in enumerate(models.intents.intents)}
+
+    def calc_intents_batch(self, queries, models, best_only=False, exhaustive=True,
+                           skip=None, floors=None):
+        """
+        Args:
+            queries (list<str>): Input sentences to test against intents
+            models (ModelSet): Intents and entities to match with
+            best_only (bool): Only return the matches with the highest
+                confidence of each shard, enough to pick the best intent
+            exhaustive (bool): Match every intent instead of only the candidates
+            skip (list<set<str>>): With best_only, intents not to match for each query
+            floors (list<float>): With best_only, confidence each query already reached
+        Returns:
+            list<list<MatchData>>: Intent matches for each query
+        """
+        with self.lock:
+            if not all(process.is_alive() for process in self.processes):
+                self.stop()
+            if not self.conns:
+                self.start()
+            if self.models is not models:
+                self.load(models)
+            message = ('match', (queries, best_only, exhaustive, skip, floors))
+            results = self._request([message] * self.num_shards)
+            order = self.order
+        return [sorted(sum(parts, []), key=lambda x: order.get(x.name, len(order)))
+                for parts in zip(*results)]
@@ -12,10 +12,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import numpy as np
 from fann2 import libfann as fann
 
 from padatious.id_manager import IdManager
-from padatious.util import resolve_conflicts, StrEnum
+from padatious.numpy_net import NumpyNet
+from padatious.util import lines_hash, resolve_conflicts, StrEnum
 
 
 class Ids(StrEnum):
@@ -33,39 +35,77 @@ class SimpleIntent(object):
     def __init__(self, name=''):
         self.name = name
         self.ids = IdManager(Ids)
-        self.net = None  # type: fann.neural_net
+        self.net = None  # type: NumpyNet
 
     def match(self, sent):
-        return max(0, self.net.run(self.vectorize(sent))[0])
+        return max(0, self.net.run_sparse_batch([self.sparse_vectorize(sent)])[0, 0])
+
+    def match_batch(self, sents):
+        """Calculates the match confidence of each tokenized sentence"""
+        if not sents:
+            return []
+        outputs = self.net.run_sparse_batch([self.sparse_vectorize(sent) for sent in sents])[:, 0]
+        return np.maximum(outputs, 0).tolist()
 
     def vectorize(self, sent):
-        vector = self.ids.vector()
+        return self.assign_features(self.ids.vector(), sent)
+
+    def sparse_vectorize(self, sent):
+        """Same as vectorize but only builds the non-zero {index: value} entries"""
+        return self.assign_features(self.ids.sparse_vector(), sent)
+
+    def assign_features(self, vector, sent):
         unknown = 0
-        for token in sent:
-            if token in self.ids:
-                self.ids.assign(vector, token, 1.0)
+        *indices, u, w_1, w_2, w_3, w_4 = self.ids.lookup(
+            sent + [Ids.unknown_tokens, Ids.w_1, Ids.w_2, Ids.w_3, Ids.w_4])
+        for index in indices:
+            if index is not None:
+                vector[index] = 1.0
             else:
                 unknown += 1
         if len(sent) > 0:
-            self.ids.assign(vector, Ids.unknown_tokens, unknown / float(len(sent)))
-            self.ids.assign(vector, Ids.w_1, len(sent) / 1)
-            self.ids.assign(vector, Ids.w_2, len(sent) / 2.)
-            self.ids.assign(vector, Ids.w_3, len(sent) / 3.)
-            self.ids.assign(vector, Ids.w_4, len(sent) / 4.)
+            vector[u] = unknown / float(len(sent))
+            vector[w_1] = len(sent) / 1
+            vector[w_2] = len(sent) / 2.
+            vector[w_3] = len(sent) / 3.
+            vector[w_4] = len(sent) / 4.
         return vector
 
     def configure_net(self):
-        self.net = fann.neural_net()
-        self.net.create_standard_array([len(self.ids), 10, 1])
-        self.net.set_activation_function_hidden(fann.SIGMOID_SYMMETRIC_STEPWISE)
-        self.net.set_activation_function_output(fann.SIGMOID_SYMMETRIC_STEPWISE)
-        self.net.set_train_stop_function(fann.STOPFUNC_BIT)
-        self.net.set_bit_fail_limit(0.1)
-
-    def train(self, train_data):
+        net = fann.neural_net()
+        net.create_standard_array([len(self.ids), 10, 1])
+        net.set_activation_function_hidden(fann.SIGMOID_SYMMETRIC_STEPWISE)
+        net.set_activation_function_output(fann.SIGMOID_SYMMETRIC_STEPWISE)
+        net.set_train_stop_function(fann.STOPFUNC_BIT)
+        net.set_bit_fail_limit(0.1)
+        return net
+
+    def build_ids(self, train_data):
         for sent in train_data.my_sents(self.name):
             self.ids.add_sent(sent)
 
+    def negatives_hash(self, train_data):
+        """
+        Hash of the negative samples of train_data as the network sees them.
+        Only the known tokens, the number of unknown tokens and the length
+        of a sentence affect its inputs so other changes keep the same hash
+        """
+        probe = SimpleIntent(self.name)
+        probe.build_ids(train_data)
+        keys = set()
+        for sent in train_data.negative_sents(self.name):
+            known = [probe.ids.adj_token(token) for token in sent if token in probe.ids]
+            keys.add('{} {} {}'.format(len(sent), len(sent) - len(known), ' '.join(sorted(set(known)))))
+        return lines_hash(sorted(keys)).hex()
+
+    def train_size(self, train_data):
+        """Estimated number of training samples, used to schedule training"""
+        return sum(len(sent) + 3 for sent in train_data.my_sents(self.name)) + \
+            train_data.num_negatives(self.name)
+
+    def train(self, train_data):
+        self.build_ids(train_data)
+
         inputs = []
         outputs = []
 
@@ -98,7 +138,7 @@ class SimpleIntent(object):
                 pollute(sent, 0)
                 pollute(sent, len(sent))
 
-        for sent in train_data.other_sents(self.name):
+        for sent in train_data.negative_sents(self.name):
             add(sent, 0.0)
         add([':null:'], 0.0)
         add([], 0.0)
@@ -117,23 +157,33 @@ class SimpleIntent(object):
         train_data.set_train_data(inputs, outputs)
 
         for _ in range(10):
-            self.configure_net()
-            self.net.train_on_data(train_data, 1000, 0, 0)
-            self.net.test_data(train_data)
-            if self.net.get_bit_fail() == 0:
+            net = self.configure_net()
+            net.train_on_data(train_data, 1000, 0, 0)
+            net.test_data(train_data)
+            if net.get_bit_fail() == 0:
                 break
+        self.net = NumpyNet.from_fann(net)
 
     def save(self, prefix):
         prefix += '.intent'
-        self.net.save(str(prefix + '.net'))  # Must have str()
+        self.net.save(prefix + '.net')
         self.ids.save(prefix)
 
+    def pack(self, writer):
+        """Record of the intent for a packed cache (see PackWriter)"""
+        return {'net': writer.add_net(self.net), 'ids': writer.add_vocab(self.ids.ids)}
+
+    @classmethod
+    def from_pack(cls, name, record, pack):
+        self = cls(name)
+        self.net = pack.net(record['net'])
+        self.ids.ids = pack.vocab(record['ids'])
+        return self
+
     @classmethod
     def from_file(cls, name, prefix):
         prefix += '.intent'
         self = cls(name)
-        self.net = fann.neural_net()
-        if not self.net.create_from_file(str(prefix + '.net')):  # Must have str()
-            raise FileNotFoundError(str(prefix + '.net'))
+        self.net = NumpyNet.from_file(prefix + '.net')
         self.ids.load(prefix)
         return self
@@ -12,17 +12,34 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import heapq
+from collections.abc import Sequence
+
+import numpy as np
+from xxhash import xxh32
+
 from padatious.util import tokenize, expand_parentheses, remove_comments
 
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+_attached = {}  # Shared corpora a training process has opened, by block name
+
 
 class TrainData(object):
     """
     Training data used to access collections
     of tokenized sentences in intent files
+
+    Args:
+        max_negatives (int): Most negative samples given to each network (None for all)
     """
 
-    def __init__(self):
+    def __init__(self, max_negatives=None):
         self.sent_lists = {}
+        self.max_negatives = max_negatives
 
     def add_lines(self, name, lines):
         lines = remove_comments(lines)
@@ -51,3 +68,140 @@ class TrainData(object):
             if name != my_name:
                 for i in sents:
                     yield i
+
+    def num_negatives(self, my_name):
+        """Number of sentences negative_sents() returns"""
+        num = sum(len(sents) for name, sents in self.sent_lists.items() if name != my_name)
+        return num if self.max_negatives is None else min(num, self.max_negatives)
+
+    def average_len(self):
+        """Average number of tokens in a sentence"""
+        lengths = [len(sent) for sent in self.all_sents()]
+        return sum(lengths) / max(len(lengths), 1)
+
+    @staticmethod
+    def _sent_hash(sent):
+        return xxh32(' '.join(sent).encode()).intdigest()
+
+    def negative_sents(self, my_name):
+        """
+        Sentences of every other name to use as negative samples. When
+        limited by max_negatives, the ones with the lowest hashes are
+        picked so the sample rarely changes as other names are added
+        """
+        if self.max_negatives is None:
+            return self.other_sents(my_name)
+        return heapq.nsmallest(self.max_negatives, self.other_sents(my_name), key=self._sent_hash)
+
+
+class _SharedSents(Sequence):
+    """Sentences of one name in a SharedTrainData, decoded on access"""
+
+    def __init__(self, data, start, end):
+        self.data = data
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        data = self.data
+        a, b = data.sent_offsets[self.start + i], data.sent_offsets[self.start + i + 1]
+        return [data.vocab[token] for token in data.token_ids[a:b].tolist()]
+
+
+class SharedTrainData(TrainData):
+    """
+    Read only copy of a TrainData kept in a shared memory block as
+    interned token ids (a flat array with sentence offsets) along with
+    the token strings, so training processes read the corpus instead of
+    receiving a pickled copy of it with every task. Pickling only sends
+    the name of the block and the sentence range of each name
+
+    Use create() in the parent and close() once training is done
+    """
+
+    def __init__(self, block, ranges, sizes, max_negatives=None):
+        super(SharedTrainData, self).__init__(max_negatives)
+        self.block = block
+        self.ranges = ranges
+        self.sizes = sizes
+        num_tokens, num_sents, vocab_size = sizes
+        tokens_size = _padded(4 * num_tokens)
+        vocab_start = tokens_size + 8 * (num_sents + 1)
+        self.token_ids = np.ndarray((num_tokens,), np.int32, block.buf)
+        self.sent_offsets = np.ndarray((num_sents + 1,), np.int64, block.buf, offset=tokens_size)
+        self.vocab = bytes(block.buf[vocab_start:vocab_start + vocab_size]).decode().split('\n')
+        self.sent_lists = {
+            name: _SharedSents(self, start, end) for name, (start, end) in ranges.items()
+        }
+
+    @staticmethod
+    def available():
+        return shared_memory is not None
+
+    @staticmethod
+    def start_tracker():
+        """
+        Starts the process that removes leftover blocks. Processes created
+        afterwards share it, so their blocks are cleaned up even if the
+        process that created a block is killed
+        """
+        resource_tracker.ensure_running()
+
+    @classmethod
+    def create(cls, train_data):
+        token_index = {}
+        token_ids, sent_offsets, ranges = [], [0], {}
+        for name, sents in train_data.sent_lists.items():
+            start = len(sent_offsets) - 1
+            for sent in sents:
+                token_ids.extend(token_index.setdefault(token, len(token_index)) for token in sent)
+                sent_offsets.append(len(token_ids))
+            ranges[name] = (start, len(sent_offsets) - 1)
+        vocab = '\n'.join(token_index).encode()
+        sizes = (len(token_ids), len(sent_offsets) - 1, len(vocab))
+
+        tokens_size = _padded(4 * len(token_ids))
+        offsets_size = 8 * len(sent_offsets)
+        block = shared_memory.SharedMemory(create=True, size=tokens_size + offsets_size + len(vocab))
+        np.ndarray((len(token_ids),), np.int32, block.buf)[:] = token_ids
+        np.ndarray((len(sent_offsets),), np.int64, block.buf, offset=tokens_size)[:] = sent_offsets
+        block.buf[tokens_size + offsets_size:tokens_size + offsets_size + len(vocab)] = vocab
+        return cls(block, ranges, sizes, train_data.max_negatives)
+
+    def release(self):
+        self.token_ids = self.sent_offsets = None
+        try:
+            self.block.close()
+        except BufferError:
+            pass  # Still used by a sentence being read. Freed on exit
+
+    def close(self):
+        """Frees the block. Only called by the process that created it"""
+        self.release()
+        self.block.unlink()
+
+    def __getstate__(self):
+        return self.block.name, self.ranges, self.sizes, self.max_negatives
+
+    def __setstate__(self, state):
+        name, ranges, sizes, max_negatives = state
+        if name not in _attached:
+            for old in _attached.values():
+                old.release()
+            _attached.clear()
+            _attached[name] = SharedTrainData(shared_memory.SharedMemory(name), ranges, sizes,
+                                              max_negatives)
+        self.__dict__.update(_attached[name].__dict__)
+
+
+def _padded(size):
+    return size + -size % 8
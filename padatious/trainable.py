@@ -34,6 +34,36 @@ class Trainable(object):
     def train(self, data):
         pass
 
+    @abstractmethod
+    def split_training(self, data):
+        """
+        Untrained networks of the object that can be trained independently
+
+        Returns:
+            list: Objects with train(data) and train_size(data) methods
+        """
+        pass
+
+    @abstractmethod
+    def join_training(self, parts):
+        """Takes the trained networks returned by split_training"""
+        pass
+
+    @abstractmethod
+    def trained_parts(self):
+        """Trained networks of the object in the order of split_training"""
+        pass
+
+    @abstractmethod
+    def negatives_hashes(self, data):
+        """
+        Hex hash of the negative samples in data as each network sees them
+
+        Returns:
+            list<str>: Hash of each network in the order of split_training
+        """
+        pass
+
     @abstractmethod
     def save(self, prefix):
         pass
@@ -42,3 +72,12 @@ class Trainable(object):
     @abstractmethod
     def from_file(self, name, folder):
         pass
+
+    @abstractmethod
+    def pack(self, writer):
+        pass
+
+    @classmethod
+    @abstractmethod
+    def from_pack(cls, name, record, pack):
+        pass
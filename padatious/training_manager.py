@@ -11,66 +11,262 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import atexit
 import multiprocessing as mp
+from collections import defaultdict
 from functools import partial
-from multiprocessing.context import TimeoutError
-from os.path import join, isfile, isdir, splitext
+from os.path import join, isfile, splitext
+from queue import Queue
+from threading import Condition, Lock, Thread
 
 import padatious
-from padatious.train_data import TrainData
+from padatious.packed_cache import PackedCache, PackWriter
+from padatious.train_data import SharedTrainData, TrainData
 from padatious.util import lines_hash
 
 
-def _train_and_save(obj, cache, data, print_updates):
-    """Internal pickleable function used to train objects in another process"""
-    obj.train(data)
-    if print_updates:
-        print('Regenerated ' + obj.name + '.')
-    obj.save(cache)
+_pools = {}
+_pools_lock = Lock()
+
+
+def _train_part(part, data):
+    """Internal pickleable function used to train networks in another process"""
+    part.train(data)
+    return part
+
+
+def get_pool(max_workers=None):
+    """
+    Process pool shared by every TrainingManager with the same max_workers
+    so concurrent training of intents and entities does not use more
+    processes than cores. It is created on first use and kept until exit
+
+    Args:
+        max_workers (int): Number of processes (None for one per core)
+    """
+    with _pools_lock:
+        if max_workers not in _pools:
+            if SharedTrainData.available():
+                SharedTrainData.start_tracker()
+            _pools[max_workers] = mp.Pool(max_workers)
+        return _pools[max_workers]
+
+
+@atexit.register
+def close_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.terminate()
+        _pools.clear()
+
+
+class LazyObject(object):
+    """
+    Stands in for a trained Intent or Entity and only loads it when
+    an attribute other than its name is first used
+
+    Args:
+        name (str): Name of the object
+        loader (Callable): Function that loads the object
+        hsh (bytes): Hash of the object's lines if known without loading it
+    """
+
+    def __init__(self, name, loader, hsh=None):
+        self.name = name
+        self.loader = loader
+        self.hash = hsh
+        self.obj = None
+        self.lock = Lock()
+
+    @property
+    def loaded(self):
+        return self.obj is not None
+
+    def load(self):
+        with self.lock:
+            if self.obj is None:
+                self.obj = self.loader()
+        return self.obj
+
+    def __getattr__(self, item):
+        # Only reached for attributes not set in __init__, which are missing
+        # from instances that were copied or unpickled without calling it
+        if item in ('name', 'loader', 'hash', 'obj', 'lock') or item.startswith('__'):
+            raise AttributeError(item)
+        return getattr(self.load(), item)
+
+
+class Prefetcher(object):
+    """Loads lazy objects in a background thread before they are first used"""
+
+    def __init__(self):
+        self.queue = Queue()
+        self.thread = None
+
+    def add(self, obj):
+        self.queue.put(obj)
+        if self.thread is None:
+            self.thread = Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            obj = self.queue.get()
+            try:
+                obj.load()
+            except Exception:
+                pass  # Raised again when the object is used
+            finally:
+                self.queue.task_done()
+
+
+class _Batch(object):
+    """Corpus of objects submitted together, freed once the last of them is done"""
+
+    def __init__(self, shared_data, remaining):
+        self.shared_data = shared_data
+        self.remaining = remaining
+
+    def job_done(self):
+        self.remaining -= 1
+        if self.remaining == 0 and self.shared_data is not None:
+            self.shared_data.close()
+
+
+class _TrainingJob(object):
+    """Trained networks of one object collected as its tasks finish"""
+
+    def __init__(self, obj, num_parts, batch):
+        self.obj = obj
+        self.num_parts = num_parts
+        self.batch = batch
+        self.parts = {}
+        self.failed = False
 
 
 class TrainingManager(object):
     """
     Manages multithreaded training of either Intents or Entities
 
+    Trained objects are saved to individual files by the training
+    processes and, once loaded, all of them are also written to a
+    single packed cache file which later loads use instead
+
+    Networks use the sentences of every other object as negative samples
+    so the packed cache also records which negatives each network was
+    trained against. Only the networks of a cached object that see the
+    negatives differently are retrained (see Trainable.negatives_hashes)
+
     Args:
         cls (Type[Trainable]): Class to wrap
         cache_dir (str): Place to store cache files
+        use_mmap (bool): Memory map the packed cache instead of reading it
+        lazy_load (bool): Only load cached objects when they are first used
+        prefetch (bool): Load lazy objects in a background thread
+        max_negatives (int): Most negative samples per network (None for all)
+        max_workers (int): Training processes (None for one per core)
     """
 
-    def __init__(self, cls, cache_dir):
+    def __init__(self, cls, cache_dir, use_mmap=False, lazy_load=False, prefetch=False,
+                 max_negatives=None, max_workers=None):
         self.cls = cls
         self.cache = cache_dir
+        self.max_workers = max_workers
+        self.debug = True
+        self.on_trained = None  # Called with each object once it is trained
+
+        self.jobs = {}  # id(object) -> _TrainingJob of objects training in the pool
+        self.completed = []  # Jobs whose networks are all back, waiting to be finished
+        self.finisher = None  # Thread that finishes completed jobs
+        self.errors = []
+        self.lock = Lock()
+        self.finished = Condition(self.lock)
         self.objects = []
         self.objects_to_train = []
 
-        self.train_data = TrainData()
+        self.train_data = TrainData(max_negatives)
+        self.line_hashes = {}
+        self.negatives = {}  # name -> [corpus hash, negatives hash of each network]
+        self.kept_parts = {}  # name -> {part index: trained network} of requeued objects
+        self.pack_file = join(cache_dir, cls.__name__.lower() + '.pack')
+        self.pack = None  # type: PackedCache
+        self.pack_dirty = False
+        self.use_mmap = use_mmap
+        self.lazy_load = lazy_load
+        self.prefetcher = Prefetcher() if lazy_load and prefetch else None
+
+    def packed(self):
+        """The packed cache, read on first use"""
+        if self.pack is None:
+            try:
+                self.pack = PackedCache.load(self.pack_file, self.use_mmap)
+            except (IOError, ValueError):
+                self.pack = PackedCache()
+        return self.pack
+
+    def is_cached(self, name, hsh):
+        """Whether an object trained on lines with the given hash is saved"""
+        record = self.packed().get(name)
+        if record is not None and record['hash'] == hsh.hex():
+            return True
+        hash_fn = join(self.cache, name + '.hash')
+        if isfile(hash_fn):
+            with open(hash_fn, 'rb') as g:
+                return g.read() == hsh
+        return False
+
+    def loader(self, name, hsh=None):
+        """Function that loads a trained object from the packed cache or its own files"""
+        record = self.packed().get(name)
+        if record is not None and (hsh is None or record['hash'] == hsh.hex()):
+            return partial(self.cls.from_pack, name, record, self.pack)
+        self.pack_dirty = True
+        return partial(self.cls.from_file, name=name, folder=self.cache)
+
+    def load_object(self, name, hsh=None):
+        """Loads a trained object, or a LazyObject with lazy_load"""
+        loader = self.loader(name, hsh)
+        if not self.lazy_load:
+            return loader()
+        record = self.packed().get(name)
+        if hsh is None and record is not None:
+            hsh = bytes.fromhex(record['hash'])
+        obj = LazyObject(name, loader, hsh)
+        if self.prefetcher:
+            self.prefetcher.add(obj)
+        return obj
+
+    def save_pack(self):
+        """Writes every loaded object to the packed cache"""
+        writer = PackWriter()
+        for obj in self.objects:
+            writer.records[obj.name] = obj.pack(writer)
+            writer.records[obj.name]['negatives'] = self.negatives.get(obj.name)
+        writer.save(self.pack_file)
+        self.pack = None
+        self.pack_dirty = False
 
     def add(self, name, lines, reload_cache=False, must_train=True):
 
                 # special case: load persisted (aka. cached) resource (i.e.
                 # entity or intent) from file into memory data structures
         if not must_train:
-            self.objects.append(
-                self.cls.from_file(
-                    name=name,
-                    folder=self.cache))
+            self.objects.append(self.load_object(name))
             # general case: load resource (entity or intent) to training queue
             # or if no change occurred to memory data structures
         else:
-            hash_fn = join(self.cache, name + '.hash')
-            old_hsh = None
-            if isfile(hash_fn):
-                with open(hash_fn, 'rb') as g:
-                    old_hsh = g.read()
             min_ver = splitext(padatious.__version__)[0]
             new_hsh = lines_hash([min_ver] + lines)
-            if reload_cache or old_hsh != new_hsh:
+            if reload_cache or not self.is_cached(name, new_hsh):
                 self.objects_to_train.append(self.cls(name=name, hsh=new_hsh))
+                self.kept_parts.pop(name, None)
+                self.pack_dirty = True
             else:
-                self.objects.append(
-                    self.cls.from_file(
-                        name=name, folder=self.cache))
+                self.objects.append(self.load_object(name, new_hsh))
+                record = self.packed().get(name)
+                if record is not None and record['hash'] == new_hsh.hex():
+                    self.negatives[name] = record.get('negatives')
+            self.line_hashes[name] = new_hsh
             self.train_data.add_lines(name, lines)
 
     def load(self, name, file_name, reload_cache=False):
@@ -78,41 +274,237 @@ class TrainingManager(object):
             self.add(name, f.read().split('\n'), reload_cache)
 
     def remove(self, name):
-        self.objects = [i for i in self.objects if i.name != name]
-        self.objects_to_train = [
-            i for i in self.objects_to_train if i.name != name]
+        self.pack_dirty = self.pack_dirty or name in self.packed()
+        with self.lock:
+            self.objects = [i for i in self.objects if i.name != name]
+            self.objects_to_train = [
+                i for i in self.objects_to_train if i.name != name]
         self.train_data.remove_lines(name)
+        self.line_hashes.pop(name, None)
+        self.negatives.pop(name, None)
+        self.kept_parts.pop(name, None)
+
+    def corpus_hash(self):
+        """Hash of the lines of every object with training data"""
+        return lines_hash(sorted(
+            name + ':' + self.line_hashes[name].hex() for name in self.train_data.sent_lists
+        )).hex()
+
+    def requeue_stale(self):
+        """
+        Moves cached objects whose negative samples changed since they were
+        trained to the training queue and records the negatives of the rest.
+        Networks of a requeued object that still see the same negatives are
+        kept and only the others are retrained. Objects cached without a
+        hash for each network are kept as they are
+        """
+        corpus = self.corpus_hash()
+        with self.lock:
+            for obj in self.objects_to_train:
+                self.negatives[obj.name] = [corpus, obj.negatives_hashes(self.train_data)]
+
+            for obj in list(self.objects):
+                stored = self.negatives.get(obj.name)
+                if obj.name not in self.line_hashes or (stored and stored[0] == corpus):
+                    continue
+                negatives = self.cls(obj.name).negatives_hashes(self.train_data)
+                trained = stored[1] if stored and isinstance(stored[1], list) else None
+                if trained is not None and trained != negatives:
+                    self.objects.remove(obj)
+                    self.objects_to_train.append(
+                        self.cls(name=obj.name, hsh=self.line_hashes[obj.name]))
+                    if len(trained) == len(negatives):
+                        parts = obj.trained_parts()
+                        self.kept_parts[obj.name] = {
+                            n: parts[n] for n, (a, b) in enumerate(zip(trained, negatives))
+                            if a == b
+                        }
+                self.negatives[obj.name] = [corpus, negatives]
+                self.pack_dirty = True
+
+    def schedule(self, objects):
+        """
+        Splits objects to train into networks, leaving out the ones kept
+        from the cached object by requeue_stale
+
+        Returns:
+            list<tuple<int, int, object>>: (object index, part index, network)
+                of every network to train, with the most training samples first
+        """
+        tasks = []
+        for i, obj in enumerate(objects):
+            kept = self.kept_parts.get(obj.name, {})
+            for j, part in enumerate(obj.split_training(self.train_data)):
+                if j not in kept:
+                    tasks.append((part.train_size(self.train_data), i, j, part))
+        tasks.sort(key=lambda x: -x[0])
+        return [task[1:] for task in tasks]
+
+    @property
+    def is_training(self):
+        """Whether objects are still training in the background"""
+        return bool(self.jobs)
+
+    def status(self):
+        """
+        Returns:
+            dict<str, str>: 'trained', 'training' or 'queued' for each object
+        """
+        with self.lock:
+            status = {i.name: 'trained' for i in self.objects}
+            status.update({i.name: 'queued' for i in self.objects_to_train})
+            status.update({job.obj.name: 'training' for job in self.jobs.values()})
+        return status
+
+    def finish(self, obj, parts):
+        """Adds an object as soon as all of its networks are trained"""
+        obj.join_training(parts)
+        obj.save(self.cache)
+        with self.lock:
+            if not any(i is obj for i in self.objects_to_train):
+                return  # Removed or replaced while training
+            self.objects_to_train = [i for i in self.objects_to_train if i is not obj]
+            self.objects.append(obj)
+            self.kept_parts.pop(obj.name, None)
+        if self.debug:
+            print('Regenerated ' + obj.name + '.')
+        if self.on_trained:
+            self.on_trained(obj)
+
+    def submit(self):
+        """Starts training every queued object that is not training yet"""
+        with self.lock:
+            objects = [i for i in self.objects_to_train if id(i) not in self.jobs]
+        tasks = self.schedule(objects)
+        if not tasks:
+            return
+
+        # Forking the pool while another thread creates shared memory
+        # could copy a held resource tracker lock into the workers
+        pool = get_pool(self.max_workers)
+
+        # Tasks read the corpus from shared memory instead of a pickled copy
+        shared = SharedTrainData.available()
+        data = SharedTrainData.create(self.train_data) if shared else self.train_data
+        batch = _Batch(data if shared else None, len(objects))
+        kept = [self.kept_parts.get(obj.name, {}) for obj in objects]
+        num_parts = defaultdict(int)
+        for i, _, _ in tasks:
+            num_parts[i] += 1
+        jobs = [_TrainingJob(obj, num_parts[i] + len(kept[i]), batch)
+                for i, obj in enumerate(objects)]
+        for job, parts in zip(jobs, kept):
+            job.parts.update(parts)
+        with self.lock:
+            self.jobs.update((id(job.obj), job) for job in jobs)
+            if self.finisher is None:
+                self.finisher = Thread(target=self._run_finisher, daemon=True)
+                self.finisher.start()
+
+        for i, j, part in tasks:
+            pool.apply_async(_train_part, (part, data),
+                             callback=partial(self._part_done, jobs[i], j),
+                             error_callback=partial(self._part_failed, jobs[i]))
+
+    # Pool callbacks run in the pool's result handler thread, which must
+    # never raise, so they only hand completed jobs to the finisher thread
+
+    def _part_done(self, job, index, part):
+        with self.lock:
+            job.parts[index] = part
+            if job.failed or len(job.parts) < job.num_parts:
+                return
+            self.completed.append(job)
+            self.finished.notify_all()
+
+    def _part_failed(self, job, error):
+        with self.lock:
+            if job.failed:
+                return
+            job.failed = True
+            self.errors.append(error)
+            self.completed.append(job)
+            self.finished.notify_all()
+
+    def _run_finisher(self):
+        """Saves completed jobs and the packed cache outside of the pool threads"""
+        while True:
+            with self.lock:
+                self.finished.wait_for(lambda: self.completed)
+                job = self.completed.pop(0)
+            if self._end_job(job):
+                return
+
+    def _end_job(self, job):
+        """
+        Returns:
+            bool: True if it was the last job and the finisher should stop
+        """
+        errors = []
+        try:
+            if not job.failed:
+                self.finish(job.obj, [job.parts[i] for i in range(job.num_parts)])
+        except Exception as e:
+            errors.append(e)
+        try:
+            job.batch.job_done()
+        except Exception as e:
+            errors.append(e)
+
+        with self.lock:
+            last = list(self.jobs) == [id(job.obj)]
+        if last and self.pack_dirty:
+            try:
+                self.save_pack()
+            except Exception as e:
+                errors.append(e)
+
+        with self.lock:
+            self.errors += errors
+            self.jobs.pop(id(job.obj), None)
+            done = not self.jobs
+            if done:
+                self.finisher = None
+            self.finished.notify_all()
+        return done
+
+    def wait(self, timeout=None):
+        """
+        Waits for objects training in the background
+
+        Returns:
+            bool: True if nothing is left training
+        """
+        with self.lock:
+            return self.finished.wait_for(lambda: not self.jobs, timeout)
 
     def train(self, debug=True, single_thread=False, timeout=20):
-        train = partial(
-            _train_and_save,
-            cache=self.cache,
-            data=self.train_data,
-            print_updates=debug)
+        """
+        Trains every queued object, adding each one as soon as it is done.
+        Objects that are not done after the timeout keep training in the
+        background and are added once they finish
 
+        Returns:
+            bool: True if nothing is left training
+        """
+        self.debug = debug
+        self.requeue_stale()
         if single_thread:
-            for i in self.objects_to_train:
-                train(i)
+            for obj in list(self.objects_to_train):
+                kept = self.kept_parts.get(obj.name, {})
+                self.finish(obj, [kept[n] if n in kept else _train_part(part, self.train_data)
+                                  for n, part in enumerate(obj.split_training(self.train_data))])
         else:
-            # Train in multiple processes to disk
-            pool = mp.Pool()
-            try:
-                pool.map_async(train, self.objects_to_train).get(timeout)
-            except TimeoutError:
-                if debug:
-                    print('Some objects timed out while training')
-            finally:
-                pool.close()
-                pool.join()
+            self.submit()
 
-        # Load saved objects from disk
-        for obj in self.objects_to_train:
-            try:
-                self.objects.append(
-                    self.cls.from_file(
-                        name=obj.name,
-                        folder=self.cache))
-            except IOError:
-                if debug:
-                    print('Took too long to train', obj.name)
-        self.objects_to_train = []
+        done = self.wait(timeout)
+        if not done and debug:
+            print('Some objects timed out while training. They will be added once trained')
+        with self.lock:
+            errors, self.errors = self.errors, []
+            save = not self.jobs and self.pack_dirty
+        if save:
+            self.save_pack()
+        if errors:
+            raise errors[0]
+        return done
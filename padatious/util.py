@@ -12,9 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from collections import OrderedDict, namedtuple
+from threading import Lock
+from time import monotonic
+
 from xxhash import xxh32
 from padatious.bracket_expansion import SentenceTreeParser
 
+CacheInfo = namedtuple('CacheInfo', 'hits misses evictions maxsize currsize')
+
 
 def lines_hash(lines):
     """
@@ -130,3 +136,54 @@ class StrEnum(object):
     def values(cls):
         return [getattr(cls, i) for i in dir(cls)
                 if not i.startswith("__") and i != 'values']
+
+
+class LRUCache(object):
+    """
+    Bounded least recently used cache that counts hits, misses and evictions.
+    It can be shared between threads
+
+    Args:
+        maxsize (int): Maximum number of entries
+        ttl (float): Seconds before an entry expires (None to never expire)
+    """
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.data:
+                self.misses += 1
+                return default
+            expires, value = self.data[key]
+            if expires is not None and expires <= monotonic():
+                del self.data[key]
+                self.evictions += 1
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        expires = None if self.ttl is None else monotonic() + self.ttl
+        with self.lock:
+            self.data[key] = (expires, value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.evictions, self.maxsize, len(self.data))
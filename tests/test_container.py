@@ -11,6 +11,9 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
 from time import monotonic
 
 import os
@@ -106,6 +109,43 @@ class TestIntentContainer:
         result = self.cont.calc_intent('something different')
         assert result.matches['other'] == 'different'
 
+    def test_instantiate_from_manifest(self):
+        self.test_add_intent()
+        self.cont.add_entity('test', self.test_entities)
+        self.cont.add_entity('other', self.other_entities)
+        self.cont.train()
+        self._write_train_data()
+        self.setup()
+        self.cont.instantiate_from_disk()
+        expected = self.cont.calc_intent('something different')
+        assert os.path.isfile(join('temp', 'manifest.json'))
+
+        self.setup()
+        self.cont.instantiate_from_disk()
+        assert len(self.cont.intents.objects) == 2
+        assert len(self.cont.entities.objects) == 2
+        result = self.cont.calc_intent('something different')
+        assert result.matches == expected.matches == {'other': 'different'}
+        assert all(i.lines is None for i in self.cont.padaos.intent_lines.values())
+
+        with open(join('temp', 'other.entity'), 'a') as f:
+            f.write('changed\n')
+        self.setup()
+        self.cont.instantiate_from_disk()
+        assert self.cont.calc_intent('something changed').matches == {'other': 'changed'}
+
+    def test_instantiate_with_added_intent(self):
+        self.test_add_intent()
+        self.cont.train()
+        self._write_train_data()
+        self.setup()
+        self.cont.add_intent('extra', ['an intent without a training file'])
+        self.cont.train(False)
+        self.cont.instantiate_from_disk()
+        assert len(self.cont.intents.objects) == 3
+        with open(join('temp', 'manifest.json')) as f:
+            assert set(json.load(f)['intents']) == {'test', 'other'}
+
     def _create_large_intent(self, depth):
         if depth == 0:
             return '(a|b|)'
@@ -134,6 +174,210 @@ class TestIntentContainer:
         b = monotonic()
         assert b - a <= 0.1
 
+    def test_training_status(self):
+        self.cont.add_intent('test', self.test_lines_with_entities)
+        self.cont.add_entity('test', self.test_entities)
+        assert self.cont.training_status() == {
+            'intents': {'test': 'queued'}, 'entities': {'{test}': 'queued'}
+        }
+        self.cont.train(False, timeout=0)
+        self.cont.train_thread.join()
+        self.cont.intents.wait(10)
+        self.cont.entities.wait(10)
+        assert self.cont.training_status() == {
+            'intents': {'test': 'trained'}, 'entities': {'{test}': 'trained'}
+        }
+        assert self.cont.calc_intent('this is a test').name == 'test'
+
+    def test_train_async(self):
+        self.cont.add_intent('test', self.test_lines_with_entities)
+        self.cont.add_entity('test', self.test_entities)
+        self.cont.train(False)
+        test = self.cont.intents.objects[0]
+
+        self.cont.add_intent('other', self.other_lines_with_entities)
+        self.cont.add_entity('other', self.other_entities)
+        future = self.cont.train_async()
+        assert self.cont.snapshot().intents.intents == [test]
+        match = self.cont.calc_intent('this is a assessment')
+        assert match.name == 'test'
+        assert match.matches == {'test': 'assessment'}
+
+        assert future.result(10)
+        assert len(self.cont.snapshot().intents.intents) == 2
+        assert self.cont.train_async().result()
+        assert {i.name for i in self.cont.intents.objects} == {'test', 'other'}
+        assert self.cont.calc_intent('something different').name == 'other'
+
+    def test_train_async_error(self):
+        self.cont.add_intent('test', self.test_lines)
+        self.cont.train(False)
+        self.cont.add_intent('other', self.other_lines)
+        train = self.cont.intents.train
+
+        def fail(*args, **kwargs):
+            raise RuntimeError('training failed')
+
+        self.cont.intents.train = fail
+        with pytest.raises(RuntimeError):
+            self.cont.train_async().result(10)
+        assert not self.cont.hold_models
+
+        self.cont.intents.train = train
+        assert self.cont.train(False)
+        assert {i.name for i in self.cont.snapshot().intents.intents} == {'test', 'other'}
+        assert self.cont.calc_intent('something else').name == 'other'
+
+    def test_concurrent_matching(self):
+        self.cont.add_intent('test', self.test_lines)
+        self.cont.add_intent('other', self.other_lines)
+        self.cont.train(False)
+        queries = ['this is a test', 'something else'] * 50
+
+        def register():
+            for i in range(20):
+                self.cont.add_intent('extra', ['an extra intent {}'.format(i)])
+                self.cont.remove_intent('extra')
+
+        with ThreadPoolExecutor(8) as executor:
+            writer = executor.submit(register)
+            results = list(executor.map(lambda q: self.cont.calc_intent(q).name, queries))
+            writer.result()
+        assert results == ['test', 'other'] * 50
+        assert not self.cont.intents.objects_to_train
+
+    @pytest.mark.parametrize('batch_window', [None, 0.01])
+    def test_calc_intent_async(self, batch_window):
+        self.cont = IntentContainer('temp', batch_window=batch_window)
+        self.cont.add_intent('test', self.test_lines)
+        self.cont.add_intent('other', self.other_lines)
+        self.cont.train(False)
+        queries = ['this is a test', 'something else', 'this is a different thing']
+        expected = self.cont.calc_intent_batch(queries)
+
+        # Matches best-first like calc_intent()
+        calc_intents_batch = self.cont._calc_intents_batch
+        calls = []
+
+        def record(queries, best_only=False):
+            calls.append(best_only)
+            return calc_intents_batch(queries, best_only)
+        self.cont._calc_intents_batch = record
+
+        async def match_all():
+            return await asyncio.gather(*[self.cont.calc_intent_async(q) for q in queries])
+        loop = asyncio.new_event_loop()
+        try:
+            results = loop.run_until_complete(match_all())
+        finally:
+            loop.close()
+        for result, match in zip(results, expected):
+            assert result.name == match.name
+            assert result.conf == pytest.approx(match.conf)
+        assert calls and all(calls)
+
+    def test_sharded(self):
+        queries = ['this is a test', 'something different', 'another assessment']
+        self.cont.add_intent('test', self.test_lines_with_entities)
+        self.cont.add_entity('test', self.test_entities)
+        self.cont.add_entity('other', self.other_entities)
+        self.cont.train(False)
+        expected = self.cont.calc_intent_batch(queries)
+
+        with IntentContainer('temp', num_shards=2, use_mmap=True) as sharded:
+            sharded.add_intent('test', self.test_lines_with_entities)
+            sharded.add_entity('test', self.test_entities)
+            sharded.add_entity('other', self.other_entities)
+            sharded.train(False)
+            for result, match in zip(sharded.calc_intent_batch(queries), expected):
+                assert (result.name, result.matches) == (match.name, match.matches)
+                assert result.conf == pytest.approx(match.conf, abs=1e-6)
+
+            sharded.add_intent('other', self.other_lines_with_entities)
+            sharded.train(False)
+            assert sharded.calc_intent('something different').name == 'other'
+            assert len(sharded.calc_intents('something different')) == 2
+
+            # A failing shard does not leave the others' replies behind
+            with pytest.raises(Exception):
+                sharded.shards._request([('match', None), ('match', (
+                    ['something different'], False, True, None, None))])
+            assert sharded.calc_intent('something different').name == 'other'
+
+            # A shard that stopped is started again
+            sharded.shards.processes[0].terminate()
+            sharded.shards.processes[0].join()
+            assert sharded.calc_intent('something different').name == 'other'
+
+            # Matches come in the order of the intents, which also breaks ties
+            for name in ('radio', 'music', 'song'):
+                sharded.add_intent(name, ['turn on the radio'])
+            sharded.train(False)
+            order = [i.name for i in sharded.snapshot().intents.intents]
+            for query in queries + ['turn on the radio']:
+                names = [i.name for i in sharded.calc_intents(query)]
+                assert names == sorted(names, key=order.index)
+            tied = [name for name in order if name in ('radio', 'music', 'song')]
+            assert sharded.calc_intent('turn on the radio').name == tied[0]
+
+        sharded = IntentContainer('temp', num_shards=2, use_mmap=True)
+        with sharded:
+            sharded.add_intent('test', self.test_lines_with_entities)
+            sharded.add_intent('other', self.other_lines_with_entities)
+            for name in ('radio', 'music', 'song'):
+                sharded.add_intent(name, ['turn on the radio'])
+            sharded.add_entity('test', self.test_entities)
+            sharded.add_entity('other', self.other_entities)
+            sharded.train(False)
+            assert sharded.calc_intent('something different').name == 'other'
+            assert sharded.models.intents.bank is None
+            assert not any(i.loaded for i in sharded.intents.objects)
+
+    def test_preselect(self):
+        self.cont.add_intent('test', self.test_lines)
+        self.cont.add_intent('other', self.other_lines)
+        self.cont.add_intent('entity', ['play {song}'])
+        self.cont.train(False)
+        all_matches = self.cont.calc_intents('something else')
+        assert {i.name for i in all_matches} == {'test', 'other', 'entity'}
+        best = self.cont.calc_intent('something else')
+
+        self.cont.exhaustive = False
+        matches = self.cont.calc_intents('something else')
+        assert [(i.name, i.conf) for i in matches] == [(i.name, i.conf) for i in all_matches]
+        match = self.cont.calc_intent('something else')
+        assert (match.name, match.matches) == (best.name, best.matches)
+        assert match.conf == pytest.approx(best.conf)
+
+    def test_best_first(self):
+        self.cont.add_intent('test', self.test_lines)
+        self.cont.add_intent('other', self.other_lines)
+        self.cont.add_intent('entity', ['play {song}', 'put on {song} please'])
+        self.cont.add_intent('padaos', ['play something'])
+        self.cont.train(False)
+        queries = ['play something', 'play my song please', 'this is a test',
+                   'another thing', 'put on the radio', '']
+        for query in queries:
+            expected = self.cont._best_match(self.cont.calc_intents(query))
+            match = self.cont.calc_intent(query)
+            assert (match.name, match.conf, match.matches) == \
+                   (expected.name, expected.conf, expected.matches)
+
+    def test_perfect_match_first(self):
+        self.cont.add_intent('hello', ['hello there', 'hi'])
+        self.cont.add_intent('play', ['play {song}'])
+        self.cont.train(False)
+
+        def fail(*args, **kwargs):
+            raise AssertionError('Intent should not be matched')
+
+        for intent in self.cont.snapshot().intents.intents:
+            intent.match_batch = fail
+        match = self.cont.calc_intent('hello there')
+        assert (match.name, match.conf) == ('hello', 1.0)
+        match = self.cont.calc_intent('play something')
+        assert (match.name, match.conf, match['song']) == ('play', 1.0, 'something')
+
     def test_train_timeout_subprocess(self):
         self.cont.add_intent('a', [
             ' '.join(random.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(5))
@@ -170,6 +414,26 @@ class TestIntentContainer:
             intents[0].name == 'test')
         assert self.cont.calc_intent('this is another test').name == 'test'
 
+    def test_calc_intents_batch(self):
+        self.test_add_intent()
+        self.cont.add_intent('entity', self.test_lines_with_entities)
+        self.cont.train(False)
+
+        def same(a, b):
+            return (a.name, a.sent, a.matches) == (b.name, b.sent, b.matches) and \
+                a.conf == pytest.approx(b.conf, abs=1e-5)
+
+        queries = ['this is another test', 'something different', 'another thing', '']
+        batch = self.cont.calc_intents_batch(queries)
+        assert len(batch) == len(queries)
+        for query, matches in zip(queries, batch):
+            single = self.cont.calc_intents(query)
+            assert len(matches) == len(single)
+            assert all(same(a, b) for a, b in zip(matches, single))
+
+        best = self.cont.calc_intent_batch(queries)
+        assert all(same(a, self.cont.calc_intent(query)) for a, query in zip(best, queries))
+
     def test_empty(self):
         self.cont.train(False)
         self.cont.calc_intent('hello')
@@ -191,6 +455,105 @@ class TestIntentContainer:
         assert high_conf > data.conf
         assert 'ent' not in data
 
+    def test_entity_cache(self):
+        self.cont = IntentContainer('temp', entity_cache_size=16)
+        self._test_entities('')
+        info = self.cont.entities.cache_info()
+        assert info.misses > 0
+        assert info.currsize > 0
+
+        self.cont.calc_intents('test two')
+        after = self.cont.entities.cache_info()
+        assert after.hits > info.hits
+
+        # Counters stay exact when queries run in several threads
+        lookups = after.hits + after.misses - info.hits - info.misses
+        with ThreadPoolExecutor(8) as executor:
+            list(executor.map(self.cont.calc_intents, ['test two'] * 64))
+        final = self.cont.entities.cache_info()
+        assert final.hits + final.misses == after.hits + after.misses + 64 * lookups
+
+    def test_result_cache(self):
+        self.cont = IntentContainer('temp', result_cache_size=2)
+        self.test_add_intent()
+        self.cont.train(False)
+
+        first = self.cont.calc_intent('this is another test')
+        first.conf = -1.0
+        second = self.cont.calc_intent('This is another test!')
+        assert second.name == 'test'
+        assert second.conf > 0
+        assert self.cont.result_cache.info().hits == 1
+
+        self.cont.calc_intent('something else')
+        self.cont.calc_intent('something different')
+        assert self.cont.result_cache.info().evictions == 1
+
+        self.cont.remove_intent('test')
+        assert len(self.cont.result_cache) == 0
+        assert self.cont.calc_intent('this is another test').name != 'test'
+
+    def test_result_cache_case(self):
+        self.cont = IntentContainer('temp', result_cache_size=8)
+        self.cont.add_intent('play', ['play {song}'])
+        self.cont.add_intent('stop', ['stop the music'])
+        self.cont.train(False)
+        def calc_best(query):
+            return self.cont._best_match(self.cont.calc_intents(query))
+
+        for calc in (self.cont.calc_intent, calc_best):
+            assert calc('play Thriller').matches == {'song': 'Thriller'}
+            assert calc('play thriller').matches == {'song': 'thriller'}
+        assert self.cont.result_cache.info().hits > 0
+
+    def test_requeue_stale(self):
+        self.cont.add_intent('lights', ['turn on the lights', 'lights on'])
+        self.cont.add_intent('time', ['what time is it', 'tell me the time'])
+        self.cont.train(False)
+
+        self.setup()
+        self.cont.add_intent('lights', ['turn on the lights', 'lights on'])
+        self.cont.add_intent('time', ['what time is it', 'tell me the time'])
+        assert not self.cont.intents.objects_to_train
+        self.cont.intents.requeue_stale()
+        assert not self.cont.intents.objects_to_train
+
+        # 'lights off' looks like 'lights on' to the time intent
+        self.cont.add_intent('off', ['lights off'])
+        self.cont.intents.requeue_stale()
+        assert {i.name for i in self.cont.intents.objects_to_train} == {'lights', 'off'}
+        self.cont.train(False)
+        assert {i.name for i in self.cont.intents.objects} == {'lights', 'time', 'off'}
+        assert self.cont.calc_intent('lights off').name == 'off'
+
+    @pytest.mark.parametrize('prefetch', [False, True])
+    def test_lazy_load(self, prefetch):
+        self.test_add_intent()
+        self.cont.add_entity('other', self.other_entities)
+        self.cont.train(False)
+        expected = self.cont.calc_intent('something different')
+
+        self.cont = IntentContainer('temp', lazy_load=True, prefetch=prefetch)
+        self.test_add_intent()
+        self.cont.add_entity('other', self.other_entities)
+        self.cont.train(False)
+        objects = self.cont.intents.objects + self.cont.entities.objects
+        if prefetch:
+            self.cont.intents.prefetcher.queue.join()
+            self.cont.entities.prefetcher.queue.join()
+        assert all(i.loaded == prefetch for i in objects)
+
+        # Neither building the bank nor a perfect padaos match loads intents
+        self.cont.snapshot()
+        assert self.cont.calc_intent('another test').name == 'test'
+        assert all(i.loaded == prefetch for i in self.cont.intents.objects)
+
+        result = self.cont.calc_intent('something different')
+        assert result.name == expected.name
+        assert result.matches == expected.matches
+        assert result.conf == pytest.approx(expected.conf, abs=1e-6)
+        assert all(i.loaded for i in self.cont.intents.objects)
+
     def test_regular_entities(self):
         self._test_entities('')
 
@@ -12,6 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import pytest
+
 from padatious.entity_edge import EntityEdge
 from padatious.train_data import TrainData
 
@@ -31,3 +33,13 @@ class TestEntityEdge:
         assert self.le.match(sent, 1) > self.le.match(sent, 2)
         assert self.re.match(sent, 1) > self.re.match(sent, 0)
         assert self.re.match(sent, 1) > self.re.match(sent, 2)
+
+    def test_match_all(self):
+        self.le.train(self.data)
+        self.re.train(self.data)
+        for sent in [['a', 'b', 'here', 'a', 'the', 'here', '3'], ['here'], []]:
+            for edge in (self.le, self.re):
+                confs = edge.match_all(sent)
+                assert len(confs) == len(sent)
+                for pos, conf in enumerate(confs):
+                    assert conf == pytest.approx(edge.match(sent, pos), abs=1e-5)
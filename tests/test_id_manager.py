@@ -49,6 +49,17 @@ class TestIdManager:
         ids.assign(vec, 'word', 0.2)
         assert vec == [0.7, 0.2]
 
+    def test_lookup(self):
+        ids = IdManager(ids={'test': 0, '#': 1, '##': 2})
+        assert ids.lookup(['test', '4', '42', 'a4', 'other']) == [0, 1, 2, None, None]
+
+    def test_shared_tokens(self):
+        ids1 = IdManager(ids={''.join(['shared', 'word']): 0})
+        ids2 = IdManager()
+        ids2.add_sent([''.join(['shared', 'word'])])
+        token1, token2 = next(iter(ids1.ids)), next(iter(ids2.ids))
+        assert token1 == token2 and token1 is token2
+
     def test_save_load(self):
         ids1 = IdManager()
         ids1.add_token('hi')
@@ -46,6 +46,41 @@ class TestIntent:
         assert '{person}' in matches
         assert matches['{person}'] == ['john']
 
+    def test_bounded_search(self):
+        sent = ['bye', 'john', 'smith']
+        assert self.i_bye.match(sent).matches['{person}'] == ['john', 'smith']
+
+        self.i_bye.pos_intents[0].MAX_SPAN = 1
+        matches = self.i_bye.match(sent).matches
+        assert all(len(i) == 1 for i in matches.values())
+
+        # The last entity is never pruned
+        self.i_bye.BEAM_WIDTH = 0
+        assert self.i_bye.match(['bye', 'john']).matches == {'{person}': ['john']}
+
+        self.data.add_lines('send', ['send {thing} to {person}', 'give {person} {thing}'])
+        i_send = Intent('send')
+        i_send.train(self.data)
+        sent = ['send', 'the', 'letter', 'to', 'john']
+        i_send.BEAM_WIDTH = 0
+        assert len(i_send.match(sent).matches) <= 1
+
+    def test_default_limits(self):
+        self.data.add_lines('send', ['send {thing} to {person}', 'give {person} {thing}'])
+        i_send = Intent('send')
+        i_send.train(self.data)
+        sents = [
+            ['send', 'the', 'letter', 'to', 'john'],
+            ['please', 'send', 'a', 'big', 'box', 'of', 'old', 'books', 'to', 'my', 'aunt', 'today'],
+            ['give', 'john', 'smith', 'the', 'red', 'car', 'and', 'bye', 'to', 'everyone']
+        ]
+        bounded = i_send.match_batch(sents)
+        i_send.BEAM_WIDTH = None
+        for pos_intent in i_send.pos_intents:
+            pos_intent.MAX_EDGES = pos_intent.MAX_SPAN = None
+        for a, b in zip(bounded, i_send.match_batch(sents)):
+            assert (a.matches, a.conf) == (b.matches, b.conf)
+
     def test_save_load(self):
         if not isdir('temp'):
             mkdir('temp')
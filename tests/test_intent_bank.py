@@ -0,0 +1,100 @@
+# Copyright 2017 Mycroft AI, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from padatious.intent import Intent
+from padatious.intent_bank import IntentBank
+from padatious.train_data import TrainData
+
+
+class TestIntentBank:
+    sents = [
+        ['hi', 'there'],
+        ['bye', 'bye', 'john'],
+        ['set', 'a', 'timer', 'for', '10', 'minutes'],
+        ['something', 'unknown'],
+        []
+    ]
+
+    def setup(self):
+        self.data = TrainData()
+        self.data.add_lines('hi', ['hello', 'hi', 'hi there'])
+        self.data.add_lines('bye', ['goodbye', 'bye', 'bye {person}', 'see you later'])
+        self.data.add_lines('timer', ['set a timer for # minutes', 'start a timer'])
+        self.intents = [Intent(name) for name in self.data.sent_lists]
+        for i in self.intents:
+            i.train(self.data)
+        self.bank = IntentBank()
+        self.bank.update(self.intents)
+
+    def check(self):
+        confs = self.bank.score_batch(self.sents)
+        assert confs.shape == (len(self.sents), len(self.bank))
+        for intent in self.intents:
+            column = self.bank.names.index(intent.name)
+            for sent, conf in zip(self.sents, confs[:, column]):
+                assert conf == pytest.approx(intent.simple_intent.match(sent), abs=1e-5)
+
+    def test_score(self):
+        self.check()
+
+    def test_update(self):
+        removed = self.intents.pop(0)
+        self.bank.update(self.intents)
+        assert removed.name not in self.bank.names
+        self.check()
+
+        self.intents.append(removed)
+        self.bank.update(self.intents)
+        assert self.bank.names[-1] == removed.name
+        self.check()
+
+    def test_weights_held_once(self):
+        self.bank.compile()
+        first_layer = sum(i.simple_intent.net.weights[0].nbytes for i in self.intents)
+        assert self.bank.data.nbytes <= first_layer
+        for block in self.bank.blocks.values():
+            shape = block.rows().shape
+            assert all(getattr(v, 'shape', None) != shape for v in vars(block).values())
+
+    def test_copy(self):
+        removed = self.intents.pop(0)
+        bank = self.bank.copy()
+        bank.update(self.intents)
+        assert removed.name not in bank.names
+        assert removed.name in self.bank.names
+        self.intents.insert(0, removed)
+        self.check()
+
+    def test_known_counts(self):
+        counts = self.bank.known_counts(self.sents)
+        for intent in self.intents:
+            column = self.bank.names.index(intent.name)
+            for sent, count in zip(self.sents, counts[:, column]):
+                assert count == sum(token in intent.simple_intent.ids for token in sent)
+
+    def test_upper_bounds(self):
+        bounds = self.bank.upper_bounds(self.sents)
+        for intent in self.intents:
+            column = self.bank.names.index(intent.name)
+            for sent, bound in zip(self.sents, bounds[:, column]):
+                # Every span of the sentence replaced by an entity token
+                for start in range(len(sent)):
+                    for end in range(start + 1, len(sent) + 1):
+                        new_sent = sent[:start] + ['{person}'] + sent[end:]
+                        assert intent.simple_intent.match(new_sent) <= bound
+
+    def test_empty(self):
+        assert IntentBank().score_batch([['hi']]).shape == (1, 0)
@@ -0,0 +1,69 @@
+# Copyright 2017 Mycroft AI, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import random
+from os.path import isdir, join
+from shutil import rmtree
+
+import numpy as np
+from fann2 import libfann as fann
+
+from padatious.numpy_net import NumpyNet, activate, SIGMOID_STEPWISE, SIGMOID_SYMMETRIC_STEPWISE
+
+
+class TestNumpyNet:
+    def setup(self):
+        random.seed(1)
+        self.inputs = [[random.random() for _ in range(4)] for __ in range(20)]
+        outputs = [[float(sum(i) > 2.0)] for i in self.inputs]
+
+        data = fann.training_data()
+        data.set_train_data(self.inputs, outputs)
+        self.fann_net = fann.neural_net()
+        self.fann_net.create_standard_array([4, 3, 1])
+        self.fann_net.set_activation_function_hidden(fann.SIGMOID_SYMMETRIC_STEPWISE)
+        self.fann_net.set_activation_function_output(fann.SIGMOID_STEPWISE)
+        self.fann_net.train_on_data(data, 100, 0, 0)
+
+    def test_matches_fann(self):
+        net = NumpyNet.from_fann(self.fann_net)
+        batch = net.run_batch(self.inputs)
+        for inp, out in zip(self.inputs, batch):
+            expected = self.fann_net.run(inp)
+            assert abs(net.run(inp)[0] - expected[0]) < NumpyNet.TOLERANCE
+            assert abs(out[0] - expected[0]) < NumpyNet.TOLERANCE
+
+    def test_sparse(self):
+        net = NumpyNet.from_fann(self.fann_net)
+        sparse = [{i: v for i, v in enumerate(inp) if v > 0.5} for inp in self.inputs] + [{}]
+        dense = [[vec.get(i, 0.0) for i in range(4)] for vec in sparse]
+        assert np.allclose(net.run_sparse_batch(sparse), net.run_batch(dense), atol=NumpyNet.TOLERANCE)
+
+    def test_save_load(self):
+        if not isdir('temp'):
+            os.mkdir('temp')
+        net = NumpyNet.from_fann(self.fann_net)
+        net.save(join('temp', 'test.net'))
+        loaded = NumpyNet.from_file(join('temp', 'test.net'))
+        assert np.allclose(loaded.run_batch(self.inputs), net.run_batch(self.inputs))
+
+    def test_activate(self):
+        x = np.array([-100, -2.7, 0, 2.7, 100], dtype=np.float32)
+        assert activate(SIGMOID_STEPWISE, x).tolist() == [0, 0, 0.5, 1, 1]
+        assert activate(SIGMOID_SYMMETRIC_STEPWISE, x).tolist() == [-1, -1, 0, 1, 1]
+
+    def teardown(self):
+        if isdir('temp'):
+            rmtree('temp')
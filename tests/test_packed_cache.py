@@ -0,0 +1,108 @@
+# Copyright 2017 Mycroft AI, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+from os import mkdir
+from os.path import isdir, join
+from shutil import rmtree
+
+import pytest
+
+from padatious.entity import Entity
+from padatious.intent import Intent
+from padatious.intent_container import IntentContainer
+from padatious.packed_cache import PackedCache, PackedVocab, PackWriter
+from padatious.train_data import TrainData
+
+
+class TestPackedCache:
+    def setup(self):
+        if not isdir('temp'):
+            mkdir('temp')
+        self.data = TrainData()
+        self.data.add_lines('hi', ['hello', 'hi', 'hi there'])
+        self.data.add_lines('bye', ['goodbye', 'bye', 'bye {person}', 'see you later'])
+        self.data.add_lines('{person}', ['john', 'mary'])
+        self.intent = Intent('bye', b'hash')
+        self.intent.train(self.data)
+        self.entity = Entity('{person}', b'ent')
+        self.entity.train(self.data)
+
+    def save_pack(self):
+        writer = PackWriter()
+        writer.records['bye'] = self.intent.pack(writer)
+        writer.records['{person}'] = self.entity.pack(writer)
+        writer.save(join('temp', 'test.pack'))
+
+    @pytest.mark.parametrize('use_mmap', [False, True])
+    def test_save_load(self, use_mmap):
+        self.save_pack()
+        pack = PackedCache.load(join('temp', 'test.pack'), use_mmap)
+        intent = Intent.from_pack('bye', pack.get('bye'), pack)
+        entity = Entity.from_pack('{person}', pack.get('{person}'), pack)
+        assert intent.hash == b'hash'
+        assert entity.hash == b'ent'
+        for sent in (['bye', 'john'], ['see', 'you'], ['hi']):
+            assert intent.match(sent).conf == pytest.approx(self.intent.match(sent).conf, abs=1e-6)
+            assert intent.match(sent).matches == self.intent.match(sent).matches
+        assert entity.match(['john']) == pytest.approx(self.entity.match(['john']), abs=1e-6)
+
+    def test_vocab(self):
+        self.save_pack()
+        pack = PackedCache.load(join('temp', 'test.pack'), use_mmap=True)
+        ids = self.intent.simple_intent.ids.ids
+        vocab = pack.vocab(pack.get('bye')['simple']['ids'])
+        assert isinstance(vocab, PackedVocab)
+        assert len(vocab) == len(ids)
+        assert dict(vocab) == ids
+        assert 'goodbye' in vocab
+        assert 'hello' not in vocab
+        assert vocab.get('hello', -1) == -1
+        with pytest.raises(KeyError):
+            vocab['hello']
+
+        pack = PackedCache.load(join('temp', 'test.pack'))
+        assert pack.vocab(pack.get('bye')['simple']['ids']) == ids
+
+    def test_invalid(self):
+        with open(join('temp', 'bad.pack'), 'wb') as f:
+            f.write(b'not a pack')
+        with pytest.raises(ValueError):
+            PackedCache.load(join('temp', 'bad.pack'))
+
+    @pytest.mark.parametrize('use_mmap', [False, True])
+    def test_container(self, use_mmap):
+        cont = IntentContainer('temp')
+        cont.add_intent('bye', ['goodbye', 'bye {person}'])
+        cont.add_entity('person', ['john', 'mary'])
+        cont.train(False)
+        expected = cont.calc_intent('bye john')
+
+        for f in os.listdir('temp'):
+            if f.endswith('.net') or f.endswith('.ids'):
+                os.remove(join('temp', f))
+
+        cont = IntentContainer('temp', use_mmap=use_mmap)
+        cont.add_intent('bye', ['goodbye', 'bye {person}'])
+        cont.add_entity('person', ['john', 'mary'])
+        assert not cont.intents.objects_to_train
+        assert not cont.entities.objects_to_train
+        cont.train(False)
+        result = cont.calc_intent('bye john')
+        assert result.matches == expected.matches
+        assert result.conf == pytest.approx(expected.conf, abs=1e-6)
+
+    def teardown(self):
+        if isdir('temp'):
+            rmtree('temp')
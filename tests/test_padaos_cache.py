@@ -0,0 +1,85 @@
+# Copyright 2017 Mycroft AI, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+from os import mkdir
+from os.path import isdir, join
+from shutil import rmtree
+
+from padatious.padaos_cache import LazyRegex, PadaosCache
+
+
+class TestPadaosCache:
+    def setup(self):
+        if not isdir('temp'):
+            mkdir('temp')
+        self.filename = join('temp', 'padaos.json')
+
+    def create(self, hello_lines=('hello', 'hi')):
+        cont = PadaosCache(self.filename)
+        cont.add_intent('hello', list(hello_lines))
+        cont.add_intent('weather', ['weather in {place}', 'is it hot'])
+        cont.add_entity('place', ['paris', 'new york'])
+        cont.calls = 0
+        create_pattern = cont._create_pattern
+
+        def counted(line):
+            cont.calls += 1
+            return create_pattern(line)
+
+        cont._create_pattern = counted
+        return cont
+
+    def test_reuse(self):
+        cont = self.create()
+        cont.compile()
+        assert cont.calls > 0
+        expected = cont.calc_intent('weather in paris')
+        assert expected['name'] == 'weather'
+
+        cont = self.create()
+        cont.compile()
+        assert cont.calls == 0
+        assert all(isinstance(i, LazyRegex) for i in cont.intents['weather'])
+        assert cont.calc_intent('weather in paris') == expected
+        assert cont.calc_intent('hi')['name'] == 'hello'
+
+    def test_changed(self):
+        self.create().compile()
+        cont = self.create(['hello', 'hey there'])
+        cont.compile()
+        assert cont.calls == 2
+        assert cont.calc_intent('hey there')['name'] == 'hello'
+        assert cont.calc_intent('hi')['name'] is None
+
+        cont.add_entity('place', ['london'])
+        cont.compile()
+        assert cont.calc_intent('weather in london')['entities'] == {'place': 'london'}
+
+    def test_padaos_upgrade(self):
+        self.create().compile()
+        with open(self.filename) as f:
+            saved = json.load(f)
+        saved['padaos'] = 'other'
+        with open(self.filename, 'w') as f:
+            json.dump(saved, f)
+
+        cont = self.create()
+        cont.compile()
+        assert cont.calls > 0
+        assert cont.calc_intent('weather in paris')['name'] == 'weather'
+
+    def teardown(self):
+        if isdir('temp'):
+            rmtree('temp')
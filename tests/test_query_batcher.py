@@ -0,0 +1,54 @@
+# Copyright 2017 Mycroft AI, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+
+import pytest
+
+from padatious.query_batcher import QueryBatcher
+
+
+class TestQueryBatcher:
+    def setup(self):
+        self.batches = []
+        self.batcher = QueryBatcher(self.match_batch, 0.01)
+
+    def match_batch(self, queries):
+        self.batches.append(queries)
+        if 'fail' in queries:
+            raise ValueError('Failed')
+        return [query.upper() for query in queries]
+
+    def run(self, queries):
+        async def match_all():
+            return await asyncio.gather(*[self.batcher.match(q) for q in queries])
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(match_all())
+        finally:
+            loop.close()
+
+    def test_batch(self):
+        assert self.run(['a', 'b', 'c']) == ['A', 'B', 'C']
+        assert self.batches == [['a', 'b', 'c']]
+        assert self.run(['d']) == ['D']
+        assert len(self.batches) == 2
+
+    def test_max_batch(self):
+        queries = [str(i) for i in range(QueryBatcher.MAX_BATCH + 1)]
+        assert self.run(queries) == queries
+        assert [len(i) for i in self.batches] == [QueryBatcher.MAX_BATCH, 1]
+
+    def test_error(self):
+        with pytest.raises(ValueError):
+            self.run(['a', 'fail'])
@@ -12,9 +12,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import os
+import pickle
 from os.path import isfile
 
-from padatious.train_data import TrainData
+import pytest
+
+from padatious.train_data import SharedTrainData, TrainData
 
 
 class TestTrainData:
@@ -35,6 +38,40 @@ class TestTrainData:
         assert cmp(self.data.other_sents('hi'), [['bye'], ['other']])
         assert cmp(self.data.all_sents(), [['hi'], ['bye'], ['other']])
 
+    def test_negative_sents(self):
+        self.data.add_lines('hi', ['hi', 'hello'])
+        self.data.add_lines('other', ['sentence {}'.format(i) for i in range(20)])
+        assert len(list(self.data.negative_sents('hi'))) == 20
+
+        self.data.max_negatives = 5
+        sample = list(self.data.negative_sents('hi'))
+        assert len(sample) == 5
+        assert all(sent[0] == 'sentence' for sent in sample)
+
+        self.data.add_lines('bye', ['bye'])
+        new_sample = list(self.data.negative_sents('hi'))
+        assert len(new_sample) == 5
+        assert len([sent for sent in sample if sent in new_sample]) >= 4
+
+    @pytest.mark.skipif(not SharedTrainData.available(), reason='Requires shared memory')
+    def test_shared(self):
+        self.data.add_lines('hi', ['hi', 'hello there'])
+        self.data.add_lines('bye', ['bye', 'see you (later|soon)'])
+        self.data.add_lines('empty', [])
+        self.data.max_negatives = 2
+        shared = SharedTrainData.create(self.data)
+        try:
+            copy = pickle.loads(pickle.dumps(shared))
+            for data in (shared, copy):
+                assert list(data.my_sents('bye')) == list(self.data.my_sents('bye'))
+                assert list(data.other_sents('bye')) == list(self.data.other_sents('bye'))
+                assert list(data.negative_sents('hi')) == list(self.data.negative_sents('hi'))
+                assert list(data.my_sents('empty')) == []
+                assert data.sent_lists['hi'][-1] == ['hello', 'there']
+            assert len(pickle.dumps(shared)) < len(pickle.dumps(self.data)) + 200
+        finally:
+            shared.close()
+
     def teardown(self):
         if isfile('temp'):
             os.remove('temp')
@@ -0,0 +1,142 @@
+# Copyright 2017 Mycroft AI, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+from os import mkdir
+from os.path import isdir
+from shutil import rmtree
+
+import pytest
+
+from padatious.entity_edge import EntityEdge
+from padatious.intent import Intent
+from padatious.simple_intent import SimpleIntent
+from padatious.training_manager import LazyObject, Prefetcher, TrainingManager, get_pool
+
+
+class TestTrainingManager:
+    def setup(self):
+        if not isdir('temp'):
+            mkdir('temp')
+        self.manager = TrainingManager(Intent, 'temp', max_workers=2)
+        self.manager.add('small', ['hi'])
+        self.manager.add('large', ['play {song} by {artist}', 'put on {song}', 'i want to hear {song}'])
+
+    def test_schedule(self):
+        tasks = self.manager.schedule(self.manager.objects_to_train)
+        assert len(tasks) == 1 + 1 + 2 * 2
+        sizes = [part.train_size(self.manager.train_data) for _, _, part in tasks]
+        assert sizes == sorted(sizes, reverse=True)
+        assert isinstance(tasks[0][2], SimpleIntent)
+        assert sum(isinstance(part, EntityEdge) for _, _, part in tasks) == 4
+
+    def test_train(self):
+        self.manager.train(debug=False)
+        assert {i.name for i in self.manager.objects} == {'small', 'large'}
+        assert not self.manager.objects_to_train
+        large = next(i for i in self.manager.objects if i.name == 'large')
+        assert len(large.pos_intents) == 2
+        assert all(edge.net is not None for i in large.pos_intents for edge in i.edges)
+        match = large.match(['play', 'hello', 'by', 'adele'])
+        assert match.matches == {'{song}': ['hello'], '{artist}': ['adele']}
+
+        pool = get_pool(2)
+        self.manager.add('other', ['something else'])
+        self.manager.train(debug=False)
+        assert get_pool(2) is pool
+
+    def test_timeout(self):
+        trained = []
+        self.manager.on_trained = trained.append
+        assert not self.manager.train(debug=False, timeout=0)
+        assert self.manager.is_training
+        assert set(self.manager.status().values()) <= {'training', 'trained'}
+
+        assert self.manager.wait(10)
+        assert {i.name for i in trained} == {'small', 'large'}
+        assert {i.name for i in self.manager.objects} == {'small', 'large'}
+        assert self.manager.status() == {'small': 'trained', 'large': 'trained'}
+        assert not self.manager.pack_dirty
+
+    def test_remove_while_training(self):
+        self.manager.train(debug=False, timeout=0)
+        self.manager.remove('large')
+        self.manager.wait(10)
+        assert [i.name for i in self.manager.objects] == ['small']
+        assert self.manager.status() == {'small': 'trained'}
+
+    def test_save_error(self):
+        def fail():
+            raise OSError('disk full')
+
+        self.manager.save_pack = fail
+        self.manager.train(debug=False, timeout=0)
+        assert self.manager.wait(10)
+        assert {i.name for i in self.manager.objects} == {'small', 'large'}
+        assert isinstance(self.manager.errors[0], OSError)
+
+        # Callbacks still run for later training
+        self.manager.errors = []
+        self.manager.add('other', ['something else'])
+        self.manager.train(debug=False, timeout=0)
+        assert self.manager.wait(10)
+        assert 'other' in {i.name for i in self.manager.objects}
+
+    def test_requeue_parts(self):
+        self.manager.add('lights', ['play the lights'])
+        self.manager.train(debug=False)
+        large = next(i for i in self.manager.objects if i.name == 'large')
+
+        # The same words in another order only change what the entity edges see
+        self.manager.add('other', ['the lights play'])
+        self.manager.requeue_stale()
+        assert 'large' in {i.name for i in self.manager.objects_to_train}
+        kept = self.manager.kept_parts['large']
+        assert kept[0] is large.simple_intent
+        assert 0 < len(kept) < 1 + 2 * 2
+        objects = self.manager.objects_to_train
+        tasks = self.manager.schedule(objects)
+        assert sum(objects[i].name == 'large' for i, _, _ in tasks) == 1 + 2 * 2 - len(kept)
+
+        self.manager.train(debug=False)
+        assert not self.manager.kept_parts
+        retrained = next(i for i in self.manager.objects if i.name == 'large')
+        assert retrained is not large
+        assert retrained.simple_intent is large.simple_intent
+        match = retrained.match(['play', 'hello', 'by', 'adele'])
+        assert match.matches == {'{song}': ['hello'], '{artist}': ['adele']}
+
+    def test_lazy_object_copy(self):
+        obj = LazyObject('small', lambda: Intent('small'))
+        copied = object.__new__(LazyObject)
+        with pytest.raises(AttributeError):
+            copied.lock
+        with pytest.raises(AttributeError):
+            copied.simple_intent
+        assert copy.copy(obj).name == 'small'
+
+    def test_prefetch_error(self):
+        def fail():
+            raise RuntimeError('corrupt model')
+
+        prefetcher = Prefetcher()
+        prefetcher.add(LazyObject('bad', fail))
+        good = LazyObject('good', lambda: Intent('good'))
+        prefetcher.add(good)
+        prefetcher.queue.join()
+        assert good.loaded
+
+    def teardown(self):
+        if isdir('temp'):
+            rmtree('temp')
@@ -12,7 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from padatious.util import lines_hash, tokenize, resolve_conflicts, StrEnum, expand_parentheses
+from padatious.util import lines_hash, tokenize, resolve_conflicts, StrEnum, expand_parentheses, \
+    LRUCache
 
 
 def test_lines_hash():
@@ -53,3 +54,14 @@ def test_str_enum():
         b = '2'
 
     assert set(MyEnum.values()) == {'1', '2'}
+
+
+def test_lru_cache():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+    assert cache.info() == (2, 1, 1, 2, 2)